@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+'''
+    Concurrent client for hashing-server.py and pki-server.py
+
+The helpers in hashing-client.py and pki-client.py block on every request, so one script
+plays one game at a time. A GameClient offers the same operations but keeps up to
+"concurrency" requests in flight at once over a pool of kept alive connections, which
+lets one process drive hundreds of games side by side.
+
+Every operation comes in two forms. client.get_hint(ID, level) blocks and returns the
+decoded response like the helpers do, client.start(client.get_hint, ID, level) returns a
+Pending straight away so several requests for one game can be sent before waiting on
+any of them. play() runs a whole game function for many games at once:
+
+    client = GameClient("localhost", 9502, concurrency=64)
+
+    def game(client, level):
+        response = client.init_game("level{}".format(level))
+        hints = [client.start(client.get_hint, response['ID'], level) for i in xrange(0, 5)]
+        return client.submit_answer(response['ID'], guess([hint.result() for hint in hints]))
+
+    results = client.play(game, [0, 1, 2] * 100, players=200)
+
+Python 2 has no asyncio, threads do the waiting here. Requests are only ever run by the
+client's own workers or by the caller's thread, never by a game, so games waiting on
+their Pendings can't starve the requests they wait for.
+'''
+
+from requests.adapters import HTTPAdapter
+
+import Queue
+import requests
+import threading
+
+
+class Pending(object):
+    '''The eventual result of a request started with GameClient.start.'''
+
+    def __init__(self):
+        self.finished = threading.Event()
+        self.value = None
+        self.error = None
+
+    def done(self):
+        return self.finished.is_set()
+
+    def result(self, timeout=None):
+        if not self.finished.wait(timeout):
+            raise RuntimeError("request still pending after {} seconds".format(timeout))
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class GameClient(object):
+
+    def __init__(self, host, port, concurrency=32, timeout=60):
+        self.base = "http://{}:{}".format(host, port)
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(concurrency)
+
+        # one connection per slot, so every request in flight has a kept alive connection to use
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=concurrency))
+
+        self.jobs = Queue.Queue()
+        for i in xrange(0, concurrency):
+            worker = threading.Thread(target=self.work, name="gameclient-{}".format(i))
+            worker.daemon = True
+            worker.start()
+
+    def work(self):
+        while True:
+            pending, function, args = self.jobs.get()
+            try:
+                pending.value = function(*args)
+            except Exception as e:
+                pending.error = e
+            pending.finished.set()
+
+    def get(self, endpoint, **params):
+        with self.slots:
+            response = self.session.get("{}/{}".format(self.base, endpoint), params=params, timeout=self.timeout)
+        if response.ok:
+            return response.json()
+
+    def batch(self, operations):
+        '''
+        Sends a list of operations in one POST /batch, e.g. [{"op": "init", "level": 1},
+        {"op": "submit", "ID": ID, "answer": 42}], and returns the list of their results.
+        '''
+        with self.slots:
+            response = self.session.post("{}/batch".format(self.base), json=operations, timeout=self.timeout)
+        if response.ok:
+            return response.json()
+
+    def start(self, function, *args):
+        '''Runs function(*args) on one of the client's workers and returns its Pending.'''
+        pending = Pending()
+        self.jobs.put((pending, function, args))
+        return pending
+
+    def init_game(self, level, matches=None):
+        '''matches is only used by level2 of the hashing server.'''
+        if matches is None:
+            return self.get(level)
+        return self.get(level, matches=matches)
+
+    def submit_answer(self, ID, answer):
+        return self.get("submit", ID=ID, answer=answer)
+
+    def get_hint(self, ID, level):
+        return self.get("hint", ID=ID, level=level)
+
+    def get_hints(self, ID, level, count):
+        return self.get("hints", ID=ID, level=level, count=count)
+
+    def get_cert(self, ID, SN):
+        return self.get("get_cert", ID=ID, SN=SN)
+
+    def play(self, game, items, players=100):
+        '''
+        Calls game(client, item) for every item with at most players games running at
+        once, and returns what each call returned in the order of items. A game that
+        raised leaves its exception in its place instead.
+        '''
+        items = list(items)
+        results = [None] * len(items)
+        queue = Queue.Queue()
+        for index in xrange(0, len(items)):
+            queue.put(index)
+
+        def player():
+            while True:
+                try:
+                    index = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    results[index] = game(self, items[index])
+                except Exception as e:
+                    results[index] = e
+
+        threads = [threading.Thread(target=player) for i in xrange(0, min(players, len(items)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
@@ -16,6 +16,9 @@ with open('./server.yaml', 'r') as fh:
         import sys
         sys.exit(1)
 
+# one pooled session for every call, so the whole game runs over a single kept alive connection
+session = requests.Session()
+
 
 def init_game(level, matches=''):
     '''
@@ -28,7 +31,7 @@ def init_game(level, matches=''):
     params = dict(
         matches=matches
     )
-    response = requests.get(url, params=params)
+    response = session.get(url, params=params)
     if response.ok:
         return response.json()
 
@@ -39,7 +42,7 @@ def submit_answer(ID, answer):
         ID=ID,
         answer=answer
     )
-    response = requests.get(url, params=params)
+    response = session.get(url, params=params)
     if response.ok:
         return response.json()
 
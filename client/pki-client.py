@@ -4,10 +4,12 @@ from datetime import datetime
 from yaml import load
 from OpenSSL import crypto
 
+import calendar
 import hashlib
 import json
 import requests
 import base64
+import time
 import types
  
 
@@ -20,6 +22,9 @@ with open('./server.yaml', 'r') as fh:
         import sys
         sys.exit(1)
 
+# one pooled session for every call, so the whole game runs over a single kept alive connection
+session = requests.Session()
+
 
 def init_game(level):
     '''
@@ -29,7 +34,7 @@ def init_game(level):
         description: The instructions for playing
     '''
     url = "http://{}:{}/{}".format(config['ip'], config['port2'], level)
-    response = requests.get(url)
+    response = session.get(url)
     if response.ok:
         return response.json()
 
@@ -46,7 +51,7 @@ def submit_answer(ID, answer):
         ID=ID,
         answer=answer
     )
-    response = requests.get(url, params=params)
+    response = session.get(url, params=params)
     if response.ok:
         return response.json()
 
@@ -57,46 +62,143 @@ def get_hint(ID, level):
         Signer: The certficate of the party that signed your cert.  Used to assess the truthfulness of the hint.
         Hint: The hint of which number the answer might be.
         Signature: The signature produced by signing the hint with the signer private key
+        cert_pem: The signer's certificate in pem format
+        cert_metadata: serial, issuer_serial, not_before and not_after (seconds since the epoch),
+                       key_usage, subject and issuer of the signer's certificate
     '''
     url = "http://{}:{}/hint".format(config['ip'], config['port2'])
     params = dict(
         ID=ID,
         level=level
     )
-    response = requests.get(url, params=params)
+    response = session.get(url, params=params)
+    if response.ok:
+        return response.json()
+
+
+def get_hints(ID, level, count):
+    '''
+    get_hints returns a dict that contains:
+        Hints: a list of up to count hints (the server caps it), each one shaped like the response of get_hint
+    '''
+    url = "http://{}:{}/hints".format(config['ip'], config['port2'])
+    params = dict(
+        ID=ID,
+        level=level,
+        count=count
+    )
+    response = session.get(url, params=params)
     if response.ok:
         return response.json()
 
 
+def stream_hints(ID, level):
+    '''
+    stream_hints yields hints shaped like the response of get_hint, one at a time, for as
+    long as you keep asking for the next one (the server stops after a while). Stop early
+    with a break, the connection is closed for you.
+    '''
+    url = "http://{}:{}/hint_stream".format(config['ip'], config['port2'])
+    params = dict(
+        ID=ID,
+        level=level
+    )
+    response = session.get(url, params=params, stream=True)
+    try:
+        if response.ok:
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+    finally:
+        response.close()
+
+
 def get_intermediate_cert_by_sn(ID, SN):
     '''
     get_cert_by_sn returns a dict that contains:
         text: The certficate associated with the SN that was provided
         pem: The certificate in pem format
+        metadata: The same fields as a hint's cert_metadata
     '''
     url = "http://{}:{}/get_cert".format(config['ip'], config['port2'])
     params = dict(
         ID=ID,
         SN=SN
     )
-    response = requests.get(url, params=params)
+    response = session.get(url, params=params)
     if response.ok:
         return response.json()
 
 
-def validate_hint_signature(hint):
+def get_crl(level, delta=None):
+    '''
+    get_crl returns the certificate revocation list of a level's CA in pem format. Load it
+    with crypto.load_crl(crypto.FILETYPE_PEM, crl), get_revoked() lists what it revoked.
+    With delta set to a CRL number it only lists the serials revoked since that CRL.
+    '''
+    url = "http://{}:{}/get_crl".format(config['ip'], config['port2'])
+    params = dict(
+        level=level
+    )
+    if delta is not None:
+        params['delta'] = delta
+    response = session.get(url, params=params)
+    if response.ok:
+        return response.text
 
-    content = hint['Hint']
-    signature = base64.b16decode(hint['Signature'])
-    cert = crypto.load_certificate(crypto.FILETYPE_PEM, hint['cert_pem'])
 
-    try:
-        outcome = crypto.verify(cert, signature, content, 'sha256') 
-        if outcome is None:
-            return True
-        return False
-    except Exception as e:
-        return False
+class Verifier(object):
+    '''
+    Checks certs and hint signatures against trust anchors that are loaded once. Parsed
+    certs are kept by their PEM text and verdicts by the cert's sha256 fingerprint, so
+    checking a cert that was seen before costs a dictionary lookup. Verdicts last as long
+    as the Verifier does, make a new one if you keep it around longer than a cert lives.
+    '''
+
+    def __init__(self, anchors=("CA.cert",)):
+        self.store = crypto.X509Store()
+        for path in anchors:
+            with open(path, 'r') as fh:
+                self.store.add_cert(crypto.load_certificate(crypto.FILETYPE_PEM, fh.read()))
+        self.certs = {}       # PEM -> (X509, fingerprint)
+        self.chains = {}      # fingerprint -> chain verdict
+        self.signatures = {}  # (fingerprint, hint, signature) -> verdict
+
+    def load(self, certificate):
+        '''The parsed cert and its fingerprint, given PEM text or an X509.'''
+        if isinstance(certificate, crypto.X509):
+            return certificate, certificate.digest('sha256')
+        if certificate not in self.certs:
+            cert = crypto.load_certificate(crypto.FILETYPE_PEM, certificate)
+            self.certs[certificate] = (cert, cert.digest('sha256'))
+        return self.certs[certificate]
+
+    def verify_chain(self, certificate):
+        cert, fingerprint = self.load(certificate)
+        if fingerprint not in self.chains:
+            try:
+                self.chains[fingerprint] = crypto.X509StoreContext(self.store, cert).verify_certificate() is None
+            except Exception as e:
+                self.chains[fingerprint] = False
+        return self.chains[fingerprint]
+
+    def verify_hint(self, hint):
+        cert, fingerprint = self.load(hint['cert_pem'])
+        key = (fingerprint, hint['Hint'], hint['Signature'])
+        if key not in self.signatures:
+            try:
+                signature = base64.b16decode(hint['Signature'])
+                self.signatures[key] = crypto.verify(cert, signature, hint['Hint'], 'sha256') is None
+            except Exception as e:
+                self.signatures[key] = False
+        return self.signatures[key]
+
+
+verifier = Verifier()
+
+
+def validate_hint_signature(hint):
+    return verifier.verify_hint(hint)
 
 
 def extract_times_from_cert(certText):
@@ -116,25 +218,39 @@ def extract_times_from_cert(certText):
     return not_before, not_after
 
 
-def valid_time(certText):
+def cert_times(certificate):
+    '''
+    cert_times returns notBefore and notAfter of a cert as seconds since the epoch. The cert
+    can be PEM or X509, which is read off the parsed cert, or the text dump in a hint's
+    Signer, which is parsed as text. Hints carry the same numbers in cert_metadata.
+    '''
+    if not isinstance(certificate, crypto.X509) and "-----BEGIN CERTIFICATE-----" not in certificate:
+        not_before, not_after = extract_times_from_cert(certificate)
+        return (calendar.timegm(time.strptime(not_before, "%b %d %H:%M:%S %Y %Z")),
+                calendar.timegm(time.strptime(not_after, "%b %d %H:%M:%S %Y %Z")))
+
+    cert = verifier.load(certificate)[0]
+    not_before = calendar.timegm(time.strptime(cert.get_notBefore().decode('ascii'), '%Y%m%d%H%M%SZ'))
+    not_after = calendar.timegm(time.strptime(cert.get_notAfter().decode('ascii'), '%Y%m%d%H%M%SZ'))
+    return not_before, not_after
+
 
-    not_before, not_after = extract_times_from_cert(certText)
+def valid_time(certificate):
 
-    begin = datetime.strptime(not_before, "%b %d %H:%M:%S %Y %Z")
-    end = datetime.strptime(not_after, "%b %d %H:%M:%S %Y %Z")
-    now = datetime.now()
+    not_before, not_after = cert_times(certificate)
+    now = time.time()
 
-    if now >= begin and now <= end:
+    if now >= not_before and now <= not_after:
         return True
 
     return False
 
 
+
 def verify_certificate_signature(certificate, root=None):
 
-    if root is None:
-        with open("CA.cert", 'r') as fh:
-            root = crypto.load_certificate(crypto.FILETYPE_PEM, fh.read())
+    if root is None: # the usual CA.cert, which the verifier already trusts
+        return verifier.verify_chain(certificate)
 
     if isinstance(certificate, types.UnicodeType): # then convert to X509
         certificate = crypto.load_certificate(crypto.FILETYPE_PEM, certificate)
@@ -151,8 +267,13 @@ def verify_certificate_signature(certificate, root=None):
         return False
 
 
-def get_intermdiate_sn_of_cert(certText):
-    lines = certText.split("\n")
+def get_intermdiate_sn_of_cert(hint):
+    # the leaf's issuer is the intermediate that signed it
+    if isinstance(hint, dict):
+        return str(hint['cert_metadata']['issuer_serial'])
+
+    # a hint's Signer text, as this took before hints carried cert_metadata
+    lines = hint.split("\n")
     for line in lines:
         if "Leaf cert signed by intermediate" in line:
             sn = line.split(":")[2].strip().split(" ")[0]
@@ -201,6 +322,21 @@ def beat_level2():
     print(json.dumps(submit_answer(response['ID'], my_answer), indent=4))
 
 
+def beat_level3():
+    level = 3
+    response = init_game("level" + str(level))
+    print(json.dumps(response, indent=4))
+
+    hint = get_hint(response['ID'], level)
+    print(json.dumps(hint, indent=4))
+
+    #your code goes here
+    my_answer = hint['Hint'][23:]
+
+    print(json.dumps(submit_answer(response['ID'], my_answer), indent=4))
+
+
 beat_level0()
 #beat_level1()
 #beat_level2()
+#beat_level3()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+'''
+    POST /batch for hashing-server.py and pki-server.py
+
+Takes a JSON array of operations and answers with a JSON array holding the result of each
+one, in the same order, exactly as the matching GET route would have answered it:
+
+    [{"op": "init", "level": 1},                       GET /level1
+     {"op": "submit", "ID": "...", "answer": 42},      GET /submit?ID=...&answer=42
+     {"op": "hint", "ID": "...", "level": 1},          GET /hint?ID=...&level=1, pki only
+     {"op": "cert", "ID": "...", "SN": 12}]            GET /get_cert?ID=...&SN=12, pki only
+
+A failed operation gets its error in its place and the rest still run. Each operation
+is held to the rate limit of the route it stands for, so a batch of hints costs as much
+as the same hints asked for one by one. At most max_batch operations fit in one request.
+'''
+
+import json
+import ratelimit
+
+
+OPERATIONS = {'submit': 'submit', 'hint': 'hint', 'cert': 'get_cert'}
+
+
+def route_of(operation):
+    if operation.get('op') == 'init':
+        return "level{}".format(operation.get('level'))
+    return OPERATIONS.get(operation.get('op'))
+
+
+def params_of(operation):
+    # the shape parse_qs gives the GET routes
+    return dict((key, [unicode(value).encode('utf-8')]) for key, value in operation.items() if key != 'op')
+
+
+def read(handler, max_batch):
+    '''The operations posted to handler, or an error message.'''
+    try:
+        length = int(handler.headers.getheader('Content-Length'))
+    except (TypeError, ValueError):
+        length = -1
+    if length < 0: # read(-1) would wait for the client to hang up
+        handler.close_connection = 1
+        return "A valid Content-Length header is required"
+    if length > max_batch * 1024:
+        handler.close_connection = 1 # the body is left unread, the connection can't carry another request
+        return "The body is too large, batches are limited to {} KB".format(max_batch)
+
+    try:
+        operations = json.loads(handler.rfile.read(length))
+    except ValueError:
+        return "The body must be a JSON array of operations"
+    if not isinstance(operations, list) or not all(isinstance(operation, dict) for operation in operations):
+        return "The body must be a JSON array of operations"
+    if len(operations) > max_batch:
+        return "Batches are limited to {} operations".format(max_batch)
+    return operations
+
+
+def execute(handler, call, max_batch):
+    '''
+    Runs the batch posted to handler. call(route, params) runs one operation the way its
+    GET route does and returns the JSON response, or None if the server has no such route.
+    '''
+    operations = read(handler, max_batch)
+    if not isinstance(operations, list):
+        return json.dumps({'Error': operations})
+
+    results = []
+    for operation in operations:
+        route = route_of(operation)
+        if route is None:
+            results.append(json.dumps({'Error': "op must be one of init, submit, hint or cert"}))
+            continue
+
+        rejection = ratelimit.reject(handler.client_address[0], route)
+        if rejection is not None:
+            results.append(rejection[2])
+            continue
+
+        result = call(route, params_of(operation))
+        if result is None:
+            result = json.dumps({'Error': "{} is not available on this server".format(route)})
+        results.append(result)
+
+    # every result is JSON already, no need to decode them just to encode the array
+    return "[" + ", ".join(results) + "]"
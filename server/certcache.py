@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+'''
+    On-disk cache of the pki-server cert hierarchy
+
+Only the root CA used to survive a restart. Now init_certs saves every level to
+<cache dir>/level<N>.json: each cert and key as PEM, the accurate flag of each leaf and
+the fingerprint of the cert that signed it, all under the serial numbers init_certs gave
+them.
+
+On the next start a cached cert stands in for a fresh one only if it was signed by the
+very cert that would sign the fresh one, and it is as valid right now as the fresh one
+would be. A new root CA therefore throws the whole level away, a re-issued intermediate
+takes its leafs with it, a changed key profile re-issues the tier it applies to, and
+leafs meant to be valid are re-issued once they come within a day of expiring. Certs
+that are meant to be expired stay expired and are kept.
+'''
+
+from datetime import datetime, timedelta
+from OpenSSL import crypto
+
+from certgen import certPEM, keyPEM, keyType
+
+import json
+import os
+
+
+EXPIRY_MARGIN = timedelta(days=1)
+
+
+def fingerprint(cert):
+    return cert.digest('sha256').decode('ascii')
+
+
+def level_path(directory, level):
+    return os.path.join(directory, "level{}.json".format(level))
+
+
+def save(directory, level, hierarchy):
+    layout = {}
+    for tier in ['ca', 'intermediates', 'leafs']:
+        layout[tier] = {}
+        for sn, entry in hierarchy[tier].items():
+            record = {'cert': certPEM(entry[0]), 'key': keyPEM(entry[1]),
+                      'issuer': hierarchy['issuers'].get((tier, sn))}
+            if tier == 'leafs':
+                record['accurate'] = entry[2]
+            layout[tier][str(sn)] = record
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+
+    # write then rename, so a crash never leaves half a level behind. Holds private keys, keep it private
+    path = level_path(directory, level)
+    fd = os.open(path + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as fh:
+        json.dump(layout, fh)
+    os.rename(path + ".tmp", path)
+
+
+def load(directory, level):
+    path = level_path(directory, level)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'r') as fh:
+        layout = json.load(fh)
+
+    hierarchy = {}
+    for tier in ['ca', 'intermediates', 'leafs']:
+        hierarchy[tier] = {}
+        for sn, record in layout.get(tier, {}).items():
+            record['cert'] = crypto.load_certificate(crypto.FILETYPE_PEM, record['cert'])
+            record['key'] = crypto.load_privatekey(crypto.FILETYPE_PEM, record['key'])
+            hierarchy[tier][int(sn)] = record
+    return hierarchy
+
+
+def state(not_before, not_after, now):
+    if now < not_before:
+        return 'early'
+    if now >= not_after:
+        return 'expired'
+    return 'valid'
+
+
+def usable(record, issuer, validity, key_type):
+    '''
+    Whether a cached record can stand in for a cert freshly issued by issuer (None for a
+    self signed CA) with validity offsets in seconds relative to now, for a key of
+    key_type, the (type, bits) given to createKeyPair.
+    '''
+    if record is None:
+        return False
+    if issuer is not None and record['issuer'] != fingerprint(issuer):
+        return False
+    if keyType(record['key']) != tuple(key_type):
+        return False
+
+    now = datetime.utcnow()
+    not_before_offset, not_after_offset = validity
+    wanted = state(now + timedelta(seconds=not_before_offset), now + timedelta(seconds=not_after_offset), now)
+
+    cert = record['cert']
+    not_before = datetime.strptime(cert.get_notBefore().decode('ascii'), '%Y%m%d%H%M%SZ')
+    not_after = datetime.strptime(cert.get_notAfter().decode('ascii'), '%Y%m%d%H%M%SZ')
+    if wanted == 'valid':
+        not_after -= EXPIRY_MARGIN
+    return state(not_before, not_after, now) == wanted
@@ -8,18 +8,90 @@ But hey, apache license is cool with it
 '''
 
 from OpenSSL import crypto
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+import calendar
+import time
 
 TYPE_RSA = crypto.TYPE_RSA
 TYPE_DSA = crypto.TYPE_DSA
+TYPE_EC = getattr(crypto, 'TYPE_EC', 408)  # pyOpenSSL 18 has no name for EVP_PKEY_EC, see keyType
+
+EC_CURVES = {256: ec.SECP256R1, 384: ec.SECP384R1}
+
+# Ed25519 is left out on purpose, pyOpenSSL 18 insists on a digest when signing
+# certificates and data, and OpenSSL refuses one for Ed25519 keys
+KEY_PROFILES = {
+    'rsa2048': (TYPE_RSA, 2048),
+    'rsa3072': (TYPE_RSA, 3072),
+    'rsa4096': (TYPE_RSA, 4096),
+    'p256': (TYPE_EC, 256),
+    'p384': (TYPE_EC, 384),
+}
+
+keyPool = None
+
+
+def setKeyPool(pool):
+    """
+    Install a keypool.KeyPool for createKeyPair to draw from.
+    Arguments: pool - The pool to use, or None to always generate keys inline
+    """
+    global keyPool
+    keyPool = pool
+
+
+def keyProfile(name):
+    """
+    Look up a named key profile.
+    Arguments: name - One of the names in KEY_PROFILES, e.g. rsa2048 or p256
+    Returns:   The (type, bits) pair to hand to createKeyPair
+    """
+    if name not in KEY_PROFILES:
+        raise ValueError("unknown key profile {}, expected one of {}".format(name, ", ".join(sorted(KEY_PROFILES))))
+    return KEY_PROFILES[name]
+
+
+def keyType(pkey):
+    """
+    Tell what kind of key a PKey holds.
+    Arguments: pkey - The key to look at
+    Returns:   Its (type, bits), as found in KEY_PROFILES
+    """
+    if isinstance(pkey.to_cryptography_key(), ec.EllipticCurvePrivateKey):
+        return TYPE_EC, pkey.bits()
+    return pkey.type(), pkey.bits()
 
 
 def createKeyPair(flavor=TYPE_RSA, bits=2048):
     """
     Create a public/private key pair.
-    Arguments: type - Key type, must be one of TYPE_RSA and TYPE_DSA
-               bits - Number of bits to use in the key
+    Arguments: type - Key type, must be one of TYPE_RSA, TYPE_DSA and TYPE_EC
+               bits - Number of bits to use in the key, for TYPE_EC the size
+                      of the NIST curve, 256 or 384
+    Returns:   The public/private key pair in a PKey object, taken from the
+               installed key pool when it holds keys of this type and size
+    """
+    if keyPool is not None and keyPool.flavor == flavor and keyPool.bits == bits:
+        return keyPool.get()
+    return generateKeyPair(flavor, bits)
+
+
+def generateKeyPair(flavor=TYPE_RSA, bits=2048):
+    """
+    Create a public/private key pair right now, never from the key pool.
+    Arguments: see createKeyPair
     Returns:   The public/private key pair in a PKey object
     """
+    if flavor == TYPE_EC:
+        # pyOpenSSL can't generate EC keys, so make one with cryptography and load it back
+        key = ec.generate_private_key(EC_CURVES[bits](), default_backend())
+        pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                serialization.NoEncryption())
+        return crypto.load_privatekey(crypto.FILETYPE_PEM, pem)
+
     pkey = crypto.PKey()
     pkey.generate_key(flavor, bits)
     return pkey
@@ -95,3 +167,76 @@ def certPEM(cert):
     return crypto.dump_certificate(crypto.FILETYPE_PEM, cert).decode('utf-8')
 
 
+def asn1Epoch(value):
+    """
+    Convert a notBefore/notAfter time as pyOpenSSL returns it to seconds since the epoch
+    """
+    return calendar.timegm(time.strptime(value.decode('ascii'), '%Y%m%d%H%M%SZ'))
+
+
+def certMetadata(cert, issuer=None):
+    """
+    The fields clients check, so they don't have to dig them out of the text dump.
+    Arguments: cert   - The certificate to describe
+               issuer - The certificate that signed it, None if self signed
+    Returns:   A dict with the serial number, the serial number of the issuer,
+               notBefore and notAfter in seconds since the epoch, the key usages
+               and the CN of subject and issuer
+    """
+    if issuer is None:
+        issuer = cert
+    key_usage = []
+    for i in range(cert.get_extension_count()):
+        extension = cert.get_extension(i)
+        if extension.get_short_name() == b'keyUsage':
+            key_usage = [usage.strip() for usage in str(extension).split(",")]
+    return {'serial': cert.get_serial_number(),
+            'issuer_serial': issuer.get_serial_number(),
+            'not_before': asn1Epoch(cert.get_notBefore()),
+            'not_after': asn1Epoch(cert.get_notAfter()),
+            'key_usage': key_usage,
+            'subject': cert.get_subject().CN,
+            'issuer': cert.get_issuer().CN}
+
+
+def renderCert(cert, issuer=None):
+    """
+    Render a certificate every way it gets served, so it only has to happen once.
+    Arguments: cert   - The certificate to render
+               issuer - The certificate that signed it, None if self signed
+    Returns:   A dict with the text dump, PEM and DER encodings, the serial
+               number and the serial number of the issuer, and the metadata
+               from certMetadata
+    """
+    if issuer is None:
+        issuer = cert
+    return {'text': certText(cert),
+            'pem': certPEM(cert),
+            'der': crypto.dump_certificate(crypto.FILETYPE_ASN1, cert),
+            'serial': cert.get_serial_number(),
+            'issuer_serial': issuer.get_serial_number(),
+            'metadata': certMetadata(cert, issuer)}
+
+
+def keyPEM(pkey):
+    return crypto.dump_privatekey(crypto.FILETYPE_PEM, pkey).decode('utf-8')
+
+
+def issueCertificate(job):
+    """
+    Create a key pair and a certificate for it in one go. Everything goes in and
+    out as PEM so the work can be handed to another process.
+    Arguments: job - Tuple of (issuer cert PEM, issuer key PEM, CN, serial,
+                     validityPeriod, extensions, (type, bits)), see
+                     createCertRequest, createCertificate and createKeyPair
+                     for the meaning of each
+    Returns:   Tuple of (cert PEM, key PEM)
+    """
+    issuerCertPEM, issuerKeyPEM, CN, serial, validityPeriod, extensions, profile = job
+    issuerCert = crypto.load_certificate(crypto.FILETYPE_PEM, issuerCertPEM)
+    issuerKey = crypto.load_privatekey(crypto.FILETYPE_PEM, issuerKeyPEM)
+
+    pkey = createKeyPair(*profile)
+    req = createCertRequest(pkey, CN=CN, extensions=extensions)
+    cert = createCertificate(req, (issuerCert, issuerKey), serial, validityPeriod)
+    return certPEM(cert), keyPEM(pkey)
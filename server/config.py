@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+'''
+    Settings shared by hashing-server.py and pki-server.py
+
+The first line of server.config is the address to listen on, find_ip.sh fills it in.
+Every line after that is an optional "key = value" setting. Blank lines and lines
+starting with # are ignored, and anything not set falls back to DEFAULTS.
+'''
+
+DEFAULTS = {
+    'mode': 'single',  # single: one request at a time, threaded: pool of worker threads, prefork: processes of those
+    'workers': 16,     # number of worker threads when mode is threaded, per process when prefork
+    'processes': 0,    # server processes when mode is prefork, 0 for one per core
+    'backlog': 128,    # pending connections the kernel will queue for us
+    'keepalive': True,        # speak HTTP/1.1 and keep connections open, threaded mode only
+    'keepalive_timeout': 15,  # seconds an idle kept alive connection may hold a worker
+    'max_batch': 500,         # most operations one POST /batch may carry
+
+    'session_ttl': 3600,          # seconds an unfinished game is kept around
+    'session_capacity': 100000,   # most unfinished games held at once, oldest go first
+    'session_backend': 'memory',  # memory, or sqlite to survive restarts and share between processes
+    'session_dir': '.',           # where the sqlite backend keeps <server>-sessions.db
+
+    'key_pool': False,            # pki-server: pre-generate RSA keys on background threads
+    'key_pool_size': 64,          # keys to stock when refilling
+    'key_pool_low_water': 16,     # refill once the stock drops to this many
+    'key_pool_workers': 2,        # threads generating keys
+    'cert_workers': 0,            # pki-server: processes issuing the cert hierarchy, 0 for one per core
+    'cert_cache': 'cert-cache',   # pki-server: directory to keep the cert hierarchy in across restarts, empty to disable
+    'key_profile': 'rsa2048',     # pki-server: key type for new certs, also key_profile.levelN, .tier and .levelN.tier
+    'max_hints': 20,              # pki-server: most hints one /hints request returns
+    'max_stream_hints': 1000,     # pki-server: most hints one /hint_stream response carries
+    'stream_timeout': 30,         # pki-server: seconds a /hint_stream reader may stall before it is dropped
+    'crl_lifetime': 3600,         # pki-server: seconds from a CRL's thisUpdate to its nextUpdate
+
+    'profile': False,             # profile a sample of requests from startup, see profiling.py
+    'profile_fraction': 0.01,     # share of requests profiled while profiling is on
+    'profile_dir': 'profiles',    # where /profile?action=dump writes .prof files
+    'admin_addresses': '127.0.0.1',  # comma separated client addresses allowed to use /profile
+
+    'rate_limit': 0,              # requests per second per client and route, 0 for no limit, see ratelimit.py
+    'rate_burst': 0,              # requests a client may send at once, 0 for twice rate_limit
+}
+
+
+def coerce(value):
+    for cast in [int, float]:
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    if value.lower() in ['true', 'yes', 'on']:
+        return True
+    if value.lower() in ['false', 'no', 'off']:
+        return False
+    return value
+
+
+def load_config(path='./server.config'):
+    with open(path, 'r') as fh:
+        lines = fh.readlines()
+
+    config = dict(DEFAULTS)
+    config['ip'] = lines[0].strip()
+
+    for number, line in enumerate(lines[1:], 2):
+        line = line.strip()
+        if line == "" or line.startswith("#"):
+            continue
+        if "=" not in line:
+            raise ValueError("line {} of {} is not a key = value pair".format(number, path))
+        key, value = line.split("=", 1)
+        config[key.strip()] = coerce(value.strip())
+
+    return config
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+'''
+Memory-mapped index of MD5 digests for answering hashing level 2
+
+A level2 answer is any number whose md5 shares the first and last "matches" hex characters
+with the commitment. Those 2 * matches characters name one of 16 ** (2 * matches) slots,
+and the index file holds one little endian uint32 per slot: one plus the smallest number
+whose digest lands there, 0 when none of the numbers hashed did. Answering a game is then
+a single read at a computed offset of the mapped file, whatever its size.
+
+    matches  slots        file
+    1        256          1 KB
+    2        65536        256 KB
+    3        16777216     64 MB
+
+Filling every slot takes about slots * ln(slots) hashes, 280 million for matches = 3.
+Building stops once every slot is filled or after --candidates numbers, whichever comes
+first. A game whose slot is still empty has to fall back to preimage.search.
+
+Usage:
+    digestindex.py build <file> [--matches=<n>] [--candidates=<n>]
+    digestindex.py lookup <file> <commitment>
+
+Options:
+    -h --help           Show this screen.
+    --matches=<n>       Characters matched at each end, 1 to 3 [default: 2]
+    --candidates=<n>    Most numbers to hash, defaults to 20 times the slot count
+'''
+
+from array import array
+
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import time
+
+
+MAGIC = b'MD5I'
+HEADER = struct.Struct('<4sII')  # magic, matches, numbers hashed
+SLOT = struct.Struct('<I')
+
+
+def slot_of(digest, matches):
+    return int(digest[0:matches] + digest[-matches:], 16)
+
+
+def build(path, matches, candidates=None):
+    if matches not in (1, 2, 3):
+        raise ValueError("matches must be 1, 2 or 3, 4 would need a 16 GB index")
+    slots = 16 ** (2 * matches)
+    candidates = candidates or 20 * slots
+
+    table = array('I', [0]) * slots
+    md5 = hashlib.md5
+    filled = 0
+    number = 0
+    start = time.time()
+    for number in xrange(0, candidates):
+        digest = md5(str(number)).hexdigest()
+        slot = int(digest[0:matches] + digest[-matches:], 16)
+        if not table[slot]:
+            table[slot] = number + 1
+            filled += 1
+            if filled == slots:
+                break
+    hashed = number + 1
+
+    if sys.byteorder == 'big':
+        table.byteswap()
+
+    with open(path + ".tmp", 'wb') as fh:
+        fh.write(HEADER.pack(MAGIC, matches, hashed))
+        table.tofile(fh)
+    os.rename(path + ".tmp", path)
+
+    return {'slots': slots, 'filled': filled, 'hashes': hashed, 'seconds': round(time.time() - start, 2)}
+
+
+class DigestIndex(object):
+
+    def __init__(self, path):
+        self.fh = open(path, 'rb')
+        self.map = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.matches, self.hashed = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or len(self.map) != HEADER.size + SLOT.size * 16 ** (2 * self.matches):
+            self.close()
+            raise ValueError("{} is not a digest index".format(path))
+
+    def lookup(self, commitment):
+        '''A number whose md5 partially matches commitment, or None if the index has none.'''
+        entry = SLOT.unpack_from(self.map, HEADER.size + SLOT.size * slot_of(commitment, self.matches))[0]
+        if entry:
+            return entry - 1
+        return None
+
+    def close(self):
+        self.map.close()
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == '__main__':
+    from docopt import docopt
+    arguments = docopt(__doc__)
+
+    if arguments['build']:
+        candidates = int(arguments['--candidates']) if arguments['--candidates'] else None
+        built = build(arguments['<file>'], int(arguments['--matches']), candidates)
+        print("{} of {} slots filled from {} hashes in {}s".format(built['filled'], built['slots'], built['hashes'], built['seconds']))
+    else:
+        index = DigestIndex(arguments['<file>'])
+        print(index.lookup(arguments['<commitment>']))
@@ -1,2 +1,8 @@
-python -c "import socket; print([l for l in ([ip for ip in socket.gethostbyname_ex(socket.gethostname())[2] if not ip.startswith(\"127.\")][:1], [[(s.connect((\"8.8.8.8\", 53)), s.getsockname()[0], s.close()) for s in [socket.socket(socket.AF_INET, socket.SOCK_DGRAM)]][0][1]]) if l][0][0]);" > ~/crypto-workshop/server/server.config
+IP=$(python -c "import socket; print([l for l in ([ip for ip in socket.gethostbyname_ex(socket.gethostname())[2] if not ip.startswith(\"127.\")][:1], [[(s.connect((\"8.8.8.8\", 53)), s.getsockname()[0], s.close()) for s in [socket.socket(socket.AF_INET, socket.SOCK_DGRAM)]][0][1]]) if l][0][0]);")
 
+# only replace the address on the first line, keep any settings below it
+if [ -s ~/crypto-workshop/server/server.config ]; then
+    sed -i "1s/.*/$IP/" ~/crypto-workshop/server/server.config
+else
+    echo $IP > ~/crypto-workshop/server/server.config
+fi
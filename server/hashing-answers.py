@@ -2,10 +2,16 @@
  
 from datetime import datetime
 
+import digestindex
 import hashlib
 import json
+import os
+import preimage
 import requests
 
+# one pooled session for every call, so the whole game runs over a single kept alive connection
+session = requests.Session()
+
 
 def init_game(level, matches=''):
     '''
@@ -18,7 +24,7 @@ def init_game(level, matches=''):
     params = dict(
         matches=matches
     )
-    response = requests.get(url, params=params)
+    response = session.get(url, params=params)
     if response.ok:
         return response.json()
  
@@ -29,7 +35,7 @@ def submit_answer(ID, answer):
         ID=ID,
         answer=answer
     )
-    response = requests.get(url, params=params)
+    response = session.get(url, params=params)
     if response.ok:
         return response.json()
 
@@ -47,10 +53,8 @@ def beat_level0():
     response = init_game("level0")
     print(json.dumps(response, indent=4))
 
-    for i in xrange(0, 256):
-        if response['commitment'] == compute_hash(str(i)):
-            my_answer = str(i)
-            break
+    found = preimage.search(response['commitment'], stop=256)
+    my_answer = str(found['answer'])
 
     response = submit_answer(response['ID'], my_answer)
     print(json.dumps(response, indent=4))
@@ -60,10 +64,8 @@ def beat_level1():
     response = init_game("level1")
     print(json.dumps(response, indent=4))
 
-    for i in xrange(0, 256):
-        if response['commitment'] == compute_hash(str(i) + "|" + response['ID'] + "|" + response['time']):
-            my_answer = str(i)
-            break
+    found = preimage.search(response['commitment'], salt="|" + response['ID'] + "|" + response['time'], stop=256)
+    my_answer = str(found['answer'])
 
     response = submit_answer(response['ID'], my_answer)
     print(json.dumps(response, indent=4))
@@ -74,24 +76,69 @@ def beat_level2():
     response = init_game("level2", chars_to_match)
     print(json.dumps(response, indent=4))
 
-    # this can be optimized much further by creating a large number of games to potentially compare against
+    # this can be optimized much further by creating a large number of games to potentially compare against,
+    # which is what hunt_level2 does
+
+    # build it once with: python digestindex.py build level2-1.idx --matches=1
+    index_path = "level2-{}.idx".format(chars_to_match)
+    answer = None
+    if os.path.exists(index_path):
+        with digestindex.DigestIndex(index_path) as index:
+            if index.matches == chars_to_match:
+                answer = index.lookup(response['commitment'])
+            else: # its answers would only match index.matches characters, search instead
+                print("{} was built with --matches={}, not {}".format(index_path, index.matches, chars_to_match))
+
+    if answer is None:
+        found = preimage.search(response['commitment'], matches=chars_to_match)
+        answer = found['answer']
+        print("{} hashes in {}s on {} workers, {} hashes/s".format(found['hashes'], found['seconds'], found['workers'], found['hashes_per_second']))
+    my_answer = str(answer)
+
+    print("submitting: {} as match to {}".format(compute_hash(my_answer), response['commitment'] ))
+    response = submit_answer(response['ID'], my_answer)
+    print(json.dumps(response, indent=4))
+
+
+def hunt_level2(games=64, chars_to_match=2):
+    '''
+    Opens many level2 games and runs one stream of hashes against all of them at once.
+    Open commitments are keyed on their first and last chars_to_match characters, so
+    each hash is checked against every game with one dict lookup, and a game is
+    submitted as soon as a hash lands on its key. With n games open the work per
+    solved game is about 1/n of what beat_level2 does. Run hashing-answers.py --hunt to
+    try it after the other levels.
+    '''
+    open_games = {}
+    for i in xrange(0, games):
+        response = init_game("level2", chars_to_match)
+        key = response['commitment'][0:chars_to_match] + response['commitment'][-chars_to_match:]
+        open_games.setdefault(key, []).append(response['ID'])
 
-    match = False
+    solved = 0
     number = 0
-    while match is False:
+    start = datetime.now()
+    while open_games:
         digest = compute_hash(str(number))
-        if response['commitment'][0:chars_to_match] == digest[0:chars_to_match]:
-            if response['commitment'][-chars_to_match:] == digest[-chars_to_match:]:
-                match = True
-                my_answer = str(number)
+        key = digest[0:chars_to_match] + digest[-chars_to_match:]
+        if key in open_games:
+            for ID in open_games.pop(key):
+                response = submit_answer(ID, str(number))
+                if "Correct" in response['Results']:
+                    solved += 1
         number += 1
 
-    print("submitting: {} as match to {}".format(compute_hash(my_answer), response['commitment'] ))
-    response = submit_answer(response['ID'], my_answer)
-    print(json.dumps(response, indent=4))
+    elapsed = (datetime.now() - start).total_seconds()
+    print("solved {} of {} games with {} hashes, {} hashes per game, in {}s".format(solved, games, number, number / games, elapsed))
+
+
+if __name__ == '__main__':
+    import sys
 
-beat_level0()
-beat_level1()
-beat_level2()
+    beat_level0()
+    beat_level1()
+    beat_level2()
+    if '--hunt' in sys.argv[1:]: # opens another 64 level2 games on the server
+        hunt_level2()
 
 
@@ -1,11 +1,19 @@
 #!/usr/bin/env python
  
-from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from BaseHTTPServer import BaseHTTPRequestHandler
 from urlparse import urlparse, parse_qs
 from random import getrandbits
 from datetime import datetime
 
+from config import load_config
+from serving import serve
+from sessions import SessionStore, make_store
+
+import batch
 import hashlib
+import metrics
+import profiling
+import ratelimit
 import json
 import uuid
  
@@ -20,7 +28,14 @@ The next feature would be to try to get sessions, so that there could be a "get
 
 '''
 
-database = {}
+database = SessionStore()
+max_batch = 500
+
+games_started = metrics.Counter('workshop_games_started_total', 'Games initialized, by level', ['level'])
+games_completed = metrics.Counter('workshop_games_completed_total', 'Games submitted, by level and outcome', ['level', 'outcome'])
+metrics.Gauge('workshop_sessions', 'Games started and not submitted yet', lambda: database.stats()['sessions'])
+metrics.Gauge('workshop_sessions_expired_total', 'Games dropped after session_ttl', lambda: database.stats()['expired'], 'counter')
+metrics.Gauge('workshop_sessions_evicted_total', 'Games dropped to stay under session_capacity', lambda: database.stats()['evicted_at_capacity'], 'counter')
 
 def pick_number(bits):
     number = str(getrandbits(bits))
@@ -59,7 +74,7 @@ def init_game(level, params):
     number = pick_number(num_bits)
     digest = compute_hash(number + salt)
 
-    database[ID] = {'pick': number, 'salt': salt, 'hash': digest, 'level': level}
+    game = {'pick': number, 'salt': salt, 'hash': digest, 'level': level}
 
     if level == '2': # add match character count to database
 
@@ -69,7 +84,10 @@ def init_game(level, params):
         if not can_be_int(params['matches'][0]):
             return json.dumps({'Error': 'You must specify an integer value'})
         
-        database[ID]['matches'] = int(params['matches'][0])
+        game['matches'] = int(params['matches'][0])
+
+    database[ID] = game # store the finished record, the sqlite backend keeps a copy
+    games_started.inc(level=level)
 
     description = "Welcome to level{}. Thanks for playing! Pick a number between 0 and {}".format(level, 2**num_bits - 1)
     response = {"ID": ID, "commitment": digest, 'description': description}
@@ -94,62 +112,112 @@ def play_game(params):
     ID = params['ID'][0]
     guess = params['answer'][0]
 
-    if ID not in database:
+    game = database.pop(ID, None) # pop rather than check and del, another worker may be submitting the same ID
+    if game is None:
         return json.dumps({"Error": "ID {} not found in database, have you already played that game?".format(ID)})
 
-    if guess == database[ID]['pick']:
+    correct = True
+    if guess == game['pick']:
         outcome = "{} is Correct!".format(guess)
-    elif database[ID]['level'] == '2' and partial_match(guess, database[ID]['matches'], database[ID]['hash']):
+    elif game['level'] == '2' and partial_match(guess, game['matches'], game['hash']):
         outcome = "{} is Correct!".format(guess)
     else:
+        correct = False
         outcome = "{} is Incorrect :(".format(guess)
+    games_completed.inc(level=game['level'], outcome='correct' if correct else 'incorrect')
 
-    salt = database[ID]['salt']
-    input_text = database[ID]['pick'] + database[ID]['salt']
-    message = "md5sum({}) = {}".format(input_text, database[ID]['hash'])
-    del database[ID]
+    salt = game['salt']
+    input_text = game['pick'] + game['salt']
+    message = "md5sum({}) = {}".format(input_text, game['hash'])
     return json.dumps({"Results": outcome, "proof": message, 'Game_ID': ID})
 
 
+def batch_call(route, params):
+    '''Runs one operation of a POST /batch, see batch.py.'''
+    if route in ['level0', 'level1', 'level2']:
+        return init_game(route[-1], params)
+    elif route in ['submit']:
+        return play_game(params)
+
+
 # HTTPRequestHandler class
 class coinFlipHandler(BaseHTTPRequestHandler):
+    routes = ['level0', 'level1', 'level2', 'submit', 'stats', 'metrics', 'profile', 'batch']
  
+    @metrics.instrument
+    @ratelimit.limited
+    @profiling.profiled
     def do_GET(self):
-        # Send response status code
-        self.send_response(200)
-
-        # Send headers
-        self.send_header('Content-type','text/html')
-        self.end_headers()
-
+        content_type = 'text/html'
         path = self.path[1:].split("?")[0]
         query = parse_qs(urlparse(self.path).query)
         if path in ['level0', 'level1', 'level2']:
             message = init_game(path[-1], query)
         elif path in ['submit']:
             message = play_game(query)
+        elif path in ['metrics']:
+            message = metrics.render()
+            content_type = metrics.CONTENT_TYPE
+        elif path in ['profile']:
+            message = profiling.admin(self.client_address, query)
+        elif path in ['stats']:
+            message = json.dumps(database.stats())
+        else:
+            message = json.dumps({"Error": "Requested endpoint not found. Available endpoints: level0, level1, level2, submit, batch (POST)"})
+
+        self.respond(message, content_type)
+        return
+
+    @metrics.instrument
+    @ratelimit.limited
+    @profiling.profiled
+    def do_POST(self):
+        path = self.path[1:].split("?")[0]
+        if path in ['batch']:
+            message = batch.execute(self, batch_call, max_batch)
         else:
-            message = json.dumps({"Error": "Requested endpoint not found. Available endpoints: level0, level1, level2, submit"})
-        self.wfile.write(bytes(str(message) + "\n"))
+            self.close_connection = 1 # we never read the body
+            message = json.dumps({"Error": "Only batch takes POST requests"})
+
+        self.respond(message)
         return
+
+    def respond(self, message, content_type='text/html'):
+        body = bytes(str(message) + "\n")
+
+        # Send response status code
+        self.send_response(200)
+
+        # Send headers, the length lets HTTP/1.1 clients keep the connection open
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        self.wfile.write(body)
  
 
 def run():
+    global database
+    global max_batch
+
     print('starting server...')
-    with open('./server.config', 'r') as fh:
-        try:
-            ip = fh.readlines()[0]
-            print(ip)
-        except Exception as e:
-            print("error loading config file. {}".format(e))
-            import sys
-            sys.exit(1)
-
-
-    server_address = (ip, 9501)
-    httpd = HTTPServer(server_address, coinFlipHandler)
-    print('running server...')
-    httpd.serve_forever()
+    try:
+        config = load_config('./server.config')
+        print(config['ip'])
+    except Exception as e:
+        print("error loading config file. {}".format(e))
+        import sys
+        sys.exit(1)
+
+    database = make_store(config, 'hashing')
+    max_batch = config['max_batch']
+
+    profiling.configure(config, 'hashing')
+    ratelimit.configure(config, coinFlipHandler.routes)
+
+    server_address = (config['ip'], 9501)
+    print('running server in {} mode...'.format(config['mode']))
+    serve(server_address, coinFlipHandler, config)
  
  
 run()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+'''
+    Pre-generated key pairs for certgen.createKeyPair
+
+Generating a 2048 bit RSA key is the slowest step of building a cert hierarchy. A KeyPool
+keeps a stock of keys generated ahead of time by background threads, OpenSSL releases the
+GIL while it searches for primes so the threads really do run alongside the server.
+
+Whenever the stock drops to low_water the workers wake up and refill it to size. A caller
+that finds the pool empty generates its own key rather than waiting, and that is counted
+as a miss. Install a pool with certgen.setKeyPool, createKeyPair then draws from it for
+keys of the same flavor and size and generates any other kind of key itself. pki-server
+stocks the pool with keys of its key_profile setting.
+'''
+
+from certgen import TYPE_RSA, generateKeyPair
+
+import threading
+import time
+
+
+class KeyPool(object):
+
+    def __init__(self, flavor=TYPE_RSA, bits=2048, size=64, low_water=16, workers=2):
+        self.flavor = flavor
+        self.bits = bits
+        self.size = size
+        self.low_water = low_water
+        self.keys = []
+        self.cond = threading.Condition()
+        self.filling = False
+        self.generated = 0
+        self.generating_time = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.stopped = False
+
+        self.workers = []
+        for i in xrange(0, workers):
+            worker = threading.Thread(target=self.fill, name="keypool-{}".format(i))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+        with self.cond: # start stocking up straight away
+            self.filling = True
+            self.cond.notify_all()
+
+    def generate(self):
+        start = time.time()
+        pkey = generateKeyPair(self.flavor, self.bits)
+        with self.cond:
+            self.generated += 1
+            self.generating_time += time.time() - start
+        return pkey
+
+    def fill(self):
+        while True:
+            with self.cond:
+                while not self.filling and not self.stopped:
+                    self.cond.wait()
+                if self.stopped:
+                    return
+
+            pkey = self.generate()
+
+            with self.cond:
+                self.keys.append(pkey)
+                if len(self.keys) >= self.size:
+                    self.filling = False
+
+    def get(self):
+        with self.cond:
+            if len(self.keys) <= self.low_water and not self.filling:
+                self.filling = True
+                self.cond.notify_all()
+            if self.keys:
+                self.hits += 1
+                return self.keys.pop()
+            self.misses += 1
+        return self.generate()
+
+    def stop(self):
+        '''
+        Lets the workers finish the key they are on and waits for them to exit. get keeps
+        working, once the stock runs out every call generates its own key.
+        '''
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        for worker in self.workers:
+            worker.join()
+
+    def stats(self):
+        with self.cond:
+            rate = self.generated / self.generating_time if self.generating_time else 0.0
+            return {'depth': len(self.keys),
+                    'size': self.size,
+                    'low_water': self.low_water,
+                    'generated': self.generated,
+                    'keys_per_second_per_worker': round(rate, 2),
+                    'hits': self.hits,
+                    'misses': self.misses}
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+'''
+Classroom load simulator for hashing-server.py and pki-server.py
+
+Every simulated player is a thread that plays games back to back the way the client
+scripts do. On the hashing server it starts a game at each level and submits a guess.
+On the pki server it starts a game, asks for hints, fetches the intermediate that signed
+the last hint and submits. Latency is recorded per endpoint and written out as JSON so
+runs against different server builds can be compared.
+
+Usage:
+    loadtest.py [options]
+
+Options:
+    -h --help             Show this screen.
+    --host=<ip>           Address the servers listen on [default: localhost]
+    --hashing-port=<n>    Port of hashing-server.py [default: 9501]
+    --pki-port=<n>        Port of pki-server.py [default: 9502]
+    --target=<name>       hashing, pki or both [default: both]
+    --players=<n>         Simulated players per server [default: 50]
+    --games=<n>           Games each player plays [default: 10]
+    --hints=<n>           Hints a pki player asks for per game [default: 3]
+    --matches=<n>         Characters to match on hashing level 2 [default: 1]
+    --output=<file>       Where to write the JSON results [default: loadtest.json]
+'''
+
+from collections import defaultdict
+from datetime import datetime
+from random import randint
+from docopt import docopt
+
+import json
+import requests
+import threading
+import time
+
+
+class Recorder(object):
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def get(self, session, base, server, endpoint, params=None):
+        start = time.time()
+        try:
+            response = session.get("{}/{}".format(base, endpoint), params=params, timeout=60)
+            body = response.json() if response.ok else None
+        except Exception:
+            body = None
+        elapsed = time.time() - start
+
+        with self.lock:
+            self.latencies["{} {}".format(server, endpoint)].append(elapsed)
+            if body is None:
+                self.errors["{} {}".format(server, endpoint)] += 1
+        return body
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def signer_sn(hint):
+    # the leaf's issuer is the intermediate that signed it
+    if 'cert_metadata' in hint:
+        return hint['cert_metadata']['issuer_serial']
+
+    # older servers only send the text dump, whose CN names the intermediate
+    for line in hint.get('Signer', "").split("\n"):
+        if "Leaf cert signed by intermediate" in line:
+            return line.split(":")[2].strip().split(" ")[0]
+
+
+def hashing_player(recorder, base, games, matches):
+    session = requests.Session()
+    for game in xrange(0, games):
+        level = game % 3
+        params = {'matches': matches} if level == 2 else None
+        response = recorder.get(session, base, 'hashing', 'level{}'.format(level), params)
+        if response is None or 'ID' not in response:
+            continue
+        recorder.get(session, base, 'hashing', 'submit', {'ID': response['ID'], 'answer': randint(0, 255)})
+
+
+def pki_player(recorder, base, games, hints):
+    session = requests.Session()
+    for game in xrange(0, games):
+        level = game % 3
+        response = recorder.get(session, base, 'pki', 'level{}'.format(level))
+        if response is None or 'ID' not in response:
+            continue
+
+        hint = None
+        for i in xrange(0, hints):
+            hint = recorder.get(session, base, 'pki', 'hint', {'ID': response['ID'], 'level': level}) or hint
+
+        if hint is not None:
+            recorder.get(session, base, 'pki', 'get_cert', {'ID': response['ID'], 'SN': signer_sn(hint)})
+
+        recorder.get(session, base, 'pki', 'submit', {'ID': response['ID'], 'answer': randint(0, 2**31 - 1)})
+
+
+def summarize(recorder, elapsed):
+    endpoints = {}
+    total = 0
+    for name, latencies in sorted(recorder.latencies.items()):
+        ordered = sorted(latencies)
+        total += len(ordered)
+        endpoints[name] = {'requests': len(ordered),
+                           'errors': recorder.errors[name],
+                           'per_second': round(len(ordered) / elapsed, 2),
+                           'p50_ms': round(percentile(ordered, 0.50) * 1000, 2),
+                           'p95_ms': round(percentile(ordered, 0.95) * 1000, 2),
+                           'p99_ms': round(percentile(ordered, 0.99) * 1000, 2),
+                           'max_ms': round(ordered[-1] * 1000, 2)}
+    return {'elapsed_seconds': round(elapsed, 2),
+            'requests': total,
+            'per_second': round(total / elapsed, 2),
+            'endpoints': endpoints}
+
+
+def run(arguments):
+    recorder = Recorder()
+    players = int(arguments['--players'])
+    games = int(arguments['--games'])
+
+    threads = []
+    if arguments['--target'] in ['hashing', 'both']:
+        base = "http://{}:{}".format(arguments['--host'], arguments['--hashing-port'])
+        for i in xrange(0, players):
+            threads.append(threading.Thread(target=hashing_player, args=(recorder, base, games, arguments['--matches'])))
+    if arguments['--target'] in ['pki', 'both']:
+        base = "http://{}:{}".format(arguments['--host'], arguments['--pki-port'])
+        for i in xrange(0, players):
+            threads.append(threading.Thread(target=pki_player, args=(recorder, base, games, int(arguments['--hints']))))
+
+    print("simulating {} players...".format(len(threads)))
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    summary = summarize(recorder, time.time() - start)
+    summary['started'] = datetime.fromtimestamp(start).isoformat()
+    summary['settings'] = dict((key.lstrip('-'), value) for key, value in arguments.items() if key.startswith('--') and key != '--help')
+
+    print("{:<20} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9}".format('endpoint', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for name, stats in sorted(summary['endpoints'].items()):
+        print("{:<20} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9}".format(name, stats['requests'], stats['errors'], stats['per_second'],
+                                                               stats['p50_ms'], stats['p95_ms'], stats['p99_ms']))
+    print("{} requests in {}s, {} req/s".format(summary['requests'], summary['elapsed_seconds'], summary['per_second']))
+
+    with open(arguments['--output'], 'w') as fh:
+        json.dump(summary, fh, indent=4, sort_keys=True)
+    print("results written to {}".format(arguments['--output']))
+
+
+run(docopt(__doc__))
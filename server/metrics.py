@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+'''
+    Prometheus metrics for hashing-server.py and pki-server.py
+
+A deliberately small take on the Prometheus client: counters and histograms with labels,
+plus gauges that are read from a callback when /metrics is scraped. Everything registers
+itself in one module level registry and render() produces the text exposition format.
+'''
+
+from contextlib import contextmanager
+
+import threading
+import time
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# seconds, from a cached get_cert up to a request stuck behind slow RSA work
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+registry = []
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in pairs) + "}"
+
+
+def format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name + format_labels(self.labels, key), value) for key, value in sorted(self.values.items())]
+
+
+class Histogram(object):
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.values = {}  # label values -> [count per bucket..., sum, count]
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            counts = self.values[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start, **labels)
+
+    def samples(self):
+        lines = []
+        with self.lock:
+            for key, counts in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append((self.name + "_bucket" + format_labels(self.labels, key, [('le', format_value(bound))]), cumulative))
+                lines.append((self.name + "_sum" + format_labels(self.labels, key), counts[-2]))
+                lines.append((self.name + "_count" + format_labels(self.labels, key), counts[-1]))
+        return lines
+
+
+class Gauge(object):
+
+    def __init__(self, name, description, read, kind='gauge'):
+        self.name = name
+        self.description = description
+        self.read = read  # called on every scrape, returns the current value
+        self.kind = kind  # counter for totals something else already keeps count of
+        registry.append(self)
+
+    def samples(self):
+        return [(self.name, self.read())]
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.append("# HELP {} {}".format(metric.name, metric.description))
+        lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+        for sample, value in metric.samples():
+            lines.append("{} {}".format(sample, format_value(value)))
+    return "\n".join(lines)
+
+
+def instrument(do_GET):
+    '''
+    Wraps a handler's do_GET to count and time every request by route. Paths that are not
+    in the handler's routes are all counted as "other", so a scanner can't invent labels.
+    '''
+    def instrumented(self):
+        route = self.path[1:].split("?")[0]
+        if route not in self.routes:
+            route = 'other'
+        start = time.time()
+        try:
+            do_GET(self)
+        finally:
+            request_seconds.observe(time.time() - start, route=route)
+            requests_total.inc(route=route)
+    return instrumented
+
+
+requests_total = Counter('workshop_http_requests_total', 'HTTP requests served, by route', ['route'])
+request_seconds = Histogram('workshop_http_request_duration_seconds', 'Time to serve an HTTP request, by route', ['route'])
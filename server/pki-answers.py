@@ -2,14 +2,19 @@
  
 from datetime import datetime
 
+import calendar
 import hashlib
 import json
 import requests
 import base64
+import time
 import types
  
 from OpenSSL import crypto
 
+# one pooled session for every call, so the whole game runs over a single kept alive connection
+session = requests.Session()
+
 
 def init_game(level):
     '''
@@ -19,7 +24,7 @@ def init_game(level):
         description: The instructions for playing
     '''
     url = "http://127.0.0.1:8081/" + level
-    response = requests.get(url)
+    response = session.get(url)
     if response.ok:
         return response.json()
 
@@ -36,7 +41,7 @@ def submit_answer(ID, answer):
         ID=ID,
         answer=answer
     )
-    response = requests.get(url, params=params)
+    response = session.get(url, params=params)
     if response.ok:
         return response.json()
 
@@ -47,85 +52,164 @@ def get_hint(ID, level):
         Signer: The certficate of the party that signed your cert.  Used to assess the truthfulness of the hint.
         Hint: The hint of which number the answer might be.
         Signature: The signature produced by signing the hint with the signer private key
+        cert_pem: The signer's certificate in pem format
+        cert_metadata: serial, issuer_serial, not_before and not_after (seconds since the epoch),
+                       key_usage, subject and issuer of the signer's certificate
     '''
     url = "http://127.0.0.1:8081/hint"
     params = dict(
         ID=ID,
         level=level
     )
-    response = requests.get(url, params=params)
+    response = session.get(url, params=params)
+    if response.ok:
+        return response.json()
+
+
+def get_hints(ID, level, count):
+    '''
+    get_hints returns a dict that contains:
+        Hints: a list of up to count hints, each one shaped like the response of get_hint
+    '''
+    url = "http://127.0.0.1:8081/hints"
+    params = dict(
+        ID=ID,
+        level=level,
+        count=count
+    )
+    response = session.get(url, params=params)
     if response.ok:
         return response.json()
 
 
+def first_hint(ID, level, check, batch=20):
+    # pull hints a batch at a time and filter them here, rather than one request per hint
+    while True:
+        for hint in get_hints(ID, level, batch)['Hints']:
+            if check(hint):
+                return hint
+
+
 def get_cert_by_sn(ID, SN):
     '''
     get_cert_by_sn returns a dict that contains:
         text: The certficate associated with the SN that was provided
         pem: The certificatein pem format
+        metadata: The same fields as a hint's cert_metadata
     '''
     url = "http://127.0.0.1:8081/get_cert"
     params = dict(
         ID=ID,
         SN=SN
     )
-    response = requests.get(url, params=params)
+    response = session.get(url, params=params)
     if response.ok:
         return response.json()
 
 
-def validate_hint(hint):  # TODO - try/catch to not rely on installing pyopenssl?
+def get_crl(level, delta=None):
+    '''
+    get_crl returns the CRL of a level's CA in pem format. With delta set to a CRL number
+    it only lists the serials revoked since that CRL.
+    '''
+    url = "http://127.0.0.1:8081/get_crl"
+    params = dict(
+        level=level
+    )
+    if delta is not None:
+        params['delta'] = delta
+    response = session.get(url, params=params)
+    if response.ok:
+        return response.text
 
-    content = hint['Hint']
-    signature = base64.b16decode(hint['Signature'])
-    cert = crypto.load_certificate(crypto.FILETYPE_PEM, hint['cert_pem'])
 
-    try:
-        outcome = crypto.verify(cert, signature, content, 'sha256') 
-        if outcome is None:
-            return True
-        print("We shouldn't be here right now")
-        return False
-    except Exception as e:
-        #print("Exception! {}".format(e))
-        return False
+def revoked_serials(crl_pem):
+    # the serials come out as hex, the hints' cert_metadata has them as numbers
+    crl = crypto.load_crl(crypto.FILETYPE_PEM, crl_pem)
+    return set(str(int(revoked.get_serial(), 16)) for revoked in crl.get_revoked() or [])
 
 
-def extract_times_from_cert(certText):
-    certLines = certText.split("\n")
-    not_after = ""
-    not_before = ""
-
-    for line in certLines:
-        if "Not After" in line:
-            not_after = line[line.find(":")+1:].strip()
-        elif "Not Before" in line:
-            not_before = line[line.find(":")+1:].strip()
-        elif not_after != "" and not_before != "":
-            break
-    if not_after == "" or not_before == "":
-        print("Unable to extract dates from cert")
-    return not_before, not_after
+class Verifier(object):
+    '''
+    Checks certs and hint signatures against trust anchors that are loaded once. Parsed
+    certs are kept by their PEM text and verdicts by the cert's sha256 fingerprint, so
+    checking a cert that was seen before costs a dictionary lookup. Verdicts last as long
+    as the Verifier does, make a new one if you keep it around longer than a cert lives.
+    '''
+
+    def __init__(self, anchors=("CA.cert",)):
+        self.store = crypto.X509Store()
+        for path in anchors:
+            with open(path, 'r') as fh:
+                self.store.add_cert(crypto.load_certificate(crypto.FILETYPE_PEM, fh.read()))
+        self.certs = {}       # PEM -> (X509, fingerprint)
+        self.chains = {}      # fingerprint -> chain verdict
+        self.signatures = {}  # (fingerprint, hint, signature) -> verdict
+
+    def load(self, certificate):
+        '''The parsed cert and its fingerprint, given PEM text or an X509.'''
+        if isinstance(certificate, crypto.X509):
+            return certificate, certificate.digest('sha256')
+        if certificate not in self.certs:
+            cert = crypto.load_certificate(crypto.FILETYPE_PEM, certificate)
+            self.certs[certificate] = (cert, cert.digest('sha256'))
+        return self.certs[certificate]
+
+    def verify_chain(self, certificate):
+        cert, fingerprint = self.load(certificate)
+        if fingerprint not in self.chains:
+            try:
+                self.chains[fingerprint] = crypto.X509StoreContext(self.store, cert).verify_certificate() is None
+            except Exception as e:
+                self.chains[fingerprint] = False
+        return self.chains[fingerprint]
+
+    def verify_hint(self, hint):
+        cert, fingerprint = self.load(hint['cert_pem'])
+        key = (fingerprint, hint['Hint'], hint['Signature'])
+        if key not in self.signatures:
+            try:
+                signature = base64.b16decode(hint['Signature'])
+                self.signatures[key] = crypto.verify(cert, signature, hint['Hint'], 'sha256') is None
+            except Exception as e:
+                self.signatures[key] = False
+        return self.signatures[key]
+
+
+verifier = Verifier()
+
+
+def validate_hint(hint):  # TODO - try/catch to not rely on installing pyopenssl?
+    return verifier.verify_hint(hint)
+
 
+def cert_times(certificate):
+    '''
+    cert_times returns notBefore and notAfter of a cert (PEM or X509) as seconds since the
+    epoch, read off the parsed cert. Hints carry the same numbers in cert_metadata.
+    '''
+    cert = verifier.load(certificate)[0]
+    not_before = calendar.timegm(time.strptime(cert.get_notBefore().decode('ascii'), '%Y%m%d%H%M%SZ'))
+    not_after = calendar.timegm(time.strptime(cert.get_notAfter().decode('ascii'), '%Y%m%d%H%M%SZ'))
+    return not_before, not_after
 
-def valid_time(certText):
 
-    not_before, not_after = extract_times_from_cert(certText)
+def valid_time(certificate):
 
-    begin = datetime.strptime(not_before, "%b %d %H:%M:%S %Y %Z")
-    end = datetime.strptime(not_after, "%b %d %H:%M:%S %Y %Z")
-    now = datetime.now()
+    not_before, not_after = cert_times(certificate)
+    now = time.time()
 
-    if now >= begin and now <= end:
+    if now >= not_before and now <= not_after:
         return True
 
     return False
 
 
+
 def verify_certificate(certificate, root=None):
 
-    if root is None:
-        root = get_ca()
+    if root is None: # CA.cert, which the verifier already trusts
+        return verifier.verify_chain(certificate)
 
     if isinstance(certificate, types.UnicodeType): # then convert to X509
         certificate = crypto.load_certificate(crypto.FILETYPE_PEM, certificate)
@@ -150,12 +234,9 @@ def get_ca():
     return cacert
 
 
-def get_sn_of_signer(certText):
-    lines = certText.split("\n")
-    for line in lines:
-        if "Leaf cert signed by intermediate" in line:
-            sn = line.split(":")[2].strip().split(" ")[0]
-            return sn
+def get_sn_of_signer(hint):
+    # the leaf's issuer is the intermediate that signed it
+    return str(hint['cert_metadata']['issuer_serial'])
 
 
 def compute_hash(value, salt=""):
@@ -170,10 +251,7 @@ def beat_level0():
     response = init_game("level" + str(level))
     print(json.dumps(response, indent=4))
 
-    hint = get_hint(response['ID'], 0)
-
-    while validate_hint(hint) is False:
-        hint = get_hint(response['ID'], 0)
+    hint = first_hint(response['ID'], level, validate_hint)
     
     my_answer = hint['Hint'][23:]
     print(json.dumps(submit_answer(response['ID'], my_answer), indent=4))
@@ -184,10 +262,7 @@ def beat_level1():
     response = init_game("level" + str(level))
     print(json.dumps(response, indent=4))
 
-    hint = get_hint(response['ID'], level)
-
-    while not valid_time(hint['Signer']):
-        hint = get_hint(response['ID'], level)
+    hint = first_hint(response['ID'], level, lambda hint: valid_time(hint['cert_pem']))
     
     my_answer = hint['Hint'][23:]
     print(json.dumps(submit_answer(response['ID'], my_answer), indent=4))
@@ -197,22 +272,34 @@ def beat_level2():
     response = init_game("level" + str(level))
     print(json.dumps(response, indent=4))
 
-    hint = get_hint(response['ID'], level)
-    #print(json.dumps(hint, indent=4))
+    intermediates = {} # SN -> pem, hints keep coming from the same few intermediates
 
-    intermediate_sn = get_sn_of_signer(hint['Signer'])
-    intermediate_cert = get_cert_by_sn(response['ID'], intermediate_sn)
+    def signed_by_trusted_intermediate(hint):
+        intermediate_sn = get_sn_of_signer(hint)
+        if intermediate_sn not in intermediates:
+            intermediates[intermediate_sn] = get_cert_by_sn(response['ID'], intermediate_sn)['pem']
+        return verify_certificate(intermediates[intermediate_sn])
 
-    while verify_certificate(intermediate_cert['pem']) is False:
-        hint = get_hint(response['ID'], level)
-        #print(json.dumps(hint, indent=4))
-        intermediate_sn = get_sn_of_signer(hint['Signer'])
-        intermediate_cert = get_cert_by_sn(response['ID'], intermediate_sn)
+    hint = first_hint(response['ID'], level, signed_by_trusted_intermediate)
     
     my_answer = hint['Hint'][23:]
     print(json.dumps(submit_answer(response['ID'], my_answer), indent=4))
 
 
+def beat_level3():
+    level = 3
+    response = init_game("level" + str(level))
+    print(json.dumps(response, indent=4))
+
+    revoked = revoked_serials(get_crl(level)) # fetched once, not per hint
+
+    hint = first_hint(response['ID'], level, lambda hint: get_sn_of_signer(hint) not in revoked)
+
+    my_answer = hint['Hint'][23:]
+    print(json.dumps(submit_answer(response['ID'], my_answer), indent=4))
+
+
 beat_level0()
 beat_level1()
 beat_level2()
+beat_level3()
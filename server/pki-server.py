@@ -1,17 +1,30 @@
 #!/usr/bin/env python
  
-from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from BaseHTTPServer import BaseHTTPRequestHandler
 from urlparse import urlparse, parse_qs
 from random import getrandbits, randint
 from datetime import datetime
 
-from certgen import createKeyPair, createCertRequest, createCertificate, certText, certPEM
+from config import load_config
+from serving import serve
+from sessions import SessionStore, make_store
+from keypool import KeyPool
+from revocation import RevocationList
+from certgen import createKeyPair, createCertRequest, createCertificate, certText, certPEM, keyPEM, renderCert, issueCertificate, setKeyPool, keyProfile
 from OpenSSL import crypto
 
+import batch
+import certcache
+import metrics
+import profiling
+import ratelimit
 import hashlib
 import json
+import time
 import uuid
 import base64
+import multiprocessing
+import socket
  
 
 '''
@@ -25,13 +38,31 @@ The next feature would be to try to get sessions, so that there could be a "get
 
 '''
 
-database = {}
+database = SessionStore()
 certs = {}
+pending = [] # certs planned by gen_intermediate and gen_leaf_cert, see issue_pending
+cached_certs = {} # level -> hierarchy loaded by certcache, see from_cache
+key_pool = None
+key_profiles = {} # key_profile settings from server.config, see key_profile
+revocations = {} # level -> RevocationList of the certs its CA revoked
+crl_lifetime = 3600
+max_hints = 20
+max_batch = 500
+max_stream_hints = 1000
+stream_timeout = 30
+
+games_started = metrics.Counter('workshop_games_started_total', 'Games initialized, by level', ['level'])
+games_completed = metrics.Counter('workshop_games_completed_total', 'Games submitted, by level and outcome', ['level', 'outcome'])
+sign_seconds = metrics.Histogram('workshop_sign_hint_duration_seconds', 'Time spent signing a hint, by level', ['level'])
+render_seconds = metrics.Histogram('workshop_cert_render_duration_seconds', 'Time spent rendering a cert, by tier', ['tier'])
+metrics.Gauge('workshop_sessions', 'Games started and not submitted yet', lambda: database.stats()['sessions'])
+metrics.Gauge('workshop_sessions_expired_total', 'Games dropped after session_ttl', lambda: database.stats()['expired'], 'counter')
+metrics.Gauge('workshop_sessions_evicted_total', 'Games dropped to stay under session_capacity', lambda: database.stats()['evicted_at_capacity'], 'counter')
 
 def get_serial_number(cert):
-    text = certText(cert).split("\n")
-    sn = [line for line in text if "Serial Number:" in line][0].split(":")[1].strip()
-    return sn
+    # same as the "Serial Number:" line of the text dump, without rendering one
+    serial = cert.get_serial_number()
+    return "{} ({})".format(serial, hex(serial).rstrip('L'))
 
 
 def get_time_offset(params):
@@ -47,6 +78,18 @@ def get_time_offset(params):
     return (not_before_offset, not_after_offset)
 
 
+def key_profile(level, tier):
+    '''
+    The (type, bits) of keys for a tier of a level. The most specific of key_profile.levelN.tier,
+    key_profile.levelN, key_profile.tier and key_profile in server.config wins.
+    '''
+    for name in ['key_profile.level{}.{}'.format(level, tier), 'key_profile.level{}'.format(level),
+                 'key_profile.{}'.format(tier), 'key_profile']:
+        if name in key_profiles:
+            return keyProfile(key_profiles[name])
+    return keyProfile('rsa2048')
+
+
 def write_ca_to_disk(key_material, is_x509_cert):
     if is_x509_cert:
         with open('CA.pkey', 'w') as CA_key:
@@ -57,7 +100,11 @@ def write_ca_to_disk(key_material, is_x509_cert):
     return True
 
 
-def gen_cert(target_key, signing_cert, signing_key, params):
+def gen_cert(signing_cert, signing_key, params, key_type):
+    '''
+    Certs are not issued here, this only packs up what certgen.issueCertificate needs
+    so issue_pending can hand the work to a process pool.
+    '''
 
     # Check Params
     if 'CN' not in params:
@@ -69,17 +116,9 @@ def gen_cert(target_key, signing_cert, signing_key, params):
 
     if 'extensions' not in params:
         params['extensions'] = []
-        
-    # genrate CSR
-    request = createCertRequest(target_key, CN=params['CN'], extensions=params['extensions'])
 
-    # kindly fulfill the request
-    cert = createCertificate(request, 
-                             (signing_cert, signing_key), 
-                             params['SN'], 
-                             (not_before_offset, not_after_offset)
-                            )
-    return cert
+    return (certPEM(signing_cert), keyPEM(signing_key), params['CN'], params['SN'],
+            (not_before_offset, not_after_offset), params['extensions'], key_type)
 
 
 def gen_ca(params={}):
@@ -98,7 +137,7 @@ def gen_ca(params={}):
         if 'SN' not in params:
             params['SN'] = 0
 
-        cakey = createKeyPair()
+        cakey = createKeyPair(*key_profile(params.get('level', 0), 'ca'))
 
         not_before_offset, not_after_offset = get_time_offset(params)
 
@@ -127,11 +166,15 @@ def gen_intermediate(level, cacert, cakey, params={}):
     params['CN'] = "Intermediate of CA with SN: {}".format(get_serial_number(cacert))
     params['SN'] = sn
     
-    intkey = createKeyPair()
-    intcert = gen_cert(intkey, cacert, cakey, params)
+    certs[level]['issuers'][('intermediates', sn)] = certcache.fingerprint(cacert)
+    key_type = key_profile(level, 'intermediates')
+    cached = from_cache(level, 'intermediates', sn, cacert, params, key_type)
+    if cached is not None:
+        certs[level]['intermediates'][sn] = cached
+        return
 
-    certs[level]['intermediates'][sn] = (intcert, intkey)
-    return intcert, intkey
+    pending.append(((level, 'intermediates', sn), gen_cert(cacert, cakey, params, key_type)))
+    certs[level]['intermediates'][sn] = None # reserve the SN, issue_pending fills it in
 
 
 def gen_leaf_cert(level, signing_cert, signing_key, params={}, accurate=False):
@@ -145,21 +188,68 @@ def gen_leaf_cert(level, signing_cert, signing_key, params={}, accurate=False):
     params['CN'] = "Leaf cert signed by intermediate with SN: {}".format(get_serial_number(signing_cert))
     params['SN'] = sn
 
-    leafkey = createKeyPair()
-    leafcert = gen_cert(leafkey, signing_cert, signing_key, params)
+    certs[level]['issuers'][('leafs', sn)] = certcache.fingerprint(signing_cert)
+    key_type = key_profile(level, 'leafs')
+    cached = from_cache(level, 'leafs', sn, signing_cert, params, key_type)
+    if cached is not None:
+        certs[level]['leafs'][sn] = cached + (accurate,)
+        return
+
+    pending.append(((level, 'leafs', sn, accurate), gen_cert(signing_cert, signing_key, params, key_type)))
+    certs[level]['leafs'][sn] = None # reserve the SN, issue_pending fills it in
+
+
+def from_cache(level, tier, sn, signing_cert, params, key_type):
+    '''
+    The cached (cert, key) for this slot, or None if it has to be issued again because
+    there is no cache, or the cached cert was signed by someone else, is stale or has the wrong kind of key.
+    '''
+    if cached_certs.get(level) is None:
+        return None
 
-    certs[level]['leafs'][sn] = (leafcert, leafkey, accurate)
-    return leafcert, leafkey
+    record = cached_certs[level][tier].get(sn)
+    if not certcache.usable(record, signing_cert, get_time_offset(params), key_type):
+        return None
+    return (record['cert'], record['key'])
+
+
+def issue_pending(pool=None):
+    '''
+    Issue every cert planned by gen_intermediate and gen_leaf_cert since the last call.
+    They only depend on certs that already exist, so with a pool they are issued in
+    parallel, and the results are stored under the serial numbers reserved for them.
+    '''
+    global certs
+    global pending
+
+    jobs = [job for destination, job in pending]
+    if pool is not None:
+        issued = pool.map(issueCertificate, jobs)
+    else:
+        issued = map(issueCertificate, jobs)
+
+    for (destination, job), (cert_pem, key_pem) in zip(pending, issued):
+        level, tier, sn = destination[:3]
+        cert = crypto.load_certificate(crypto.FILETYPE_PEM, cert_pem)
+        key = crypto.load_privatekey(crypto.FILETYPE_PEM, key_pem)
+        certs[level][tier][sn] = (cert, key) + destination[3:] # leafs also carry their accurate flag
+    pending = []
+    return len(issued)
 
 '''
     Level1 -> Expired cert
     Level2 -> Untrusted CA
+    Level3 -> Problem with Intermediate (revocation), see get_crl
     Not implemented
-        Level3 -> Problem with Intermediate (revocation)  
         Level4 -> Problem with Intermediate (not a signing authority)
 '''
-def init_certs(level):
+def init_certs(level, pool=None, cache_dir=None):
     global certs
+    global cached_certs
+    global revocations
+
+    if cache_dir:
+        cached_certs[level] = certcache.load(cache_dir, level)
 
     if 0 not in certs: # make sure CA is init no matter what level we start with
         cacert, cakey = gen_ca()
@@ -169,8 +259,17 @@ def init_certs(level):
         certs[level] = {'ca': { 0: (certs[0]['ca'][0][0], certs[0]['ca'][0][1]) } } 
         cacert, cakey = certs[0]['ca'][0]
 
+    revocations[level] = RevocationList(certs[level]['ca'][0][0], certs[level]['ca'][0][1], crl_lifetime)
+
+    issued = 0
+    certs[level]['issuers'] = {} # (tier, sn) -> fingerprint of the signing cert, kept for the cache
+
     if level == 2:
-        cacert, cakey = gen_ca(params={'SN': 1, 'gen_new': True})
+        cached = from_cache(level, 'ca', 1, None, {}, key_profile(level, 'ca'))
+        if cached is None:
+            cached = gen_ca(params={'SN': 1, 'gen_new': True, 'level': level})
+            issued += 1
+        cacert, cakey = cached
         certs[level]['ca'][1] = (cacert, cakey)
 
     certs[level]['intermediates'] = {}
@@ -188,8 +287,11 @@ def init_certs(level):
             else: # Don't use trusted CA to sign most level 2 intermediate certs
                 gen_intermediate(level, certs[level]['ca'][1][0], certs[level]['ca'][1][1], params)
 
-        # elif level == 3: TODO placeholder to call cert revocation here, but not i == 9
-            
+        elif level == 3:
+            gen_intermediate(level, cacert, cakey, params)
+            if i != 4: # sn #5 signs the accurate leafs, every other intermediate is revoked
+                revocations[level].revoke(i + 1, 'keyCompromise')
+
         elif level == 4:
             if i == 7:
                 gen_intermediate(level, cacert, cakey, params)
@@ -199,6 +301,8 @@ def init_certs(level):
         else: # by default use a trusted ca, and include signing extension
             gen_intermediate(level, cacert, cakey, params)
 
+    issued += issue_pending(pool)
+
     # Create leaf certs - 2 per intermediate
     for int_sn in certs[level]['intermediates'].keys(): 
         intcert, intkey = certs[level]['intermediates'][int_sn]
@@ -243,6 +347,39 @@ def init_certs(level):
                 gen_leaf_cert(level, intcert, intkey, {}, accurate=False)
                 gen_leaf_cert(level, intcert, intkey, {}, accurate=False)
 
+    issued += issue_pending(pool)
+
+    render_level(level)
+
+    if cache_dir:
+        certcache.save(cache_dir, level, certs[level])
+        total = len(certs[level]['ca']) - 1 + len(certs[level]['intermediates']) + len(certs[level]['leafs']) # root CA is not ours to issue
+        print("level {}: issued {} certs, reused {} from {}".format(level, issued, total - issued, cache_dir))
+
+
+def render_level(level):
+    '''
+    Render every cert of a level once, up front. The certs never change, so the hint and
+    get_cert handlers only ever serve these.
+    '''
+    global certs
+
+    signers = {}
+    for tier in ['ca', 'intermediates']:
+        for sn in certs[level][tier]:
+            cert = certs[level][tier][sn][0]
+            signers[certcache.fingerprint(cert)] = cert
+
+    certs[level]['rendered'] = {}
+    for tier in ['ca', 'intermediates', 'leafs']:
+        for sn in certs[level][tier]:
+            issuer = signers.get(certs[level]['issuers'].get((tier, sn))) # None for the CAs
+            with render_seconds.time(tier=tier):
+                rendered = renderCert(certs[level][tier][sn][0], issuer)
+            if tier == 'intermediates': # get_cert's whole response never changes either
+                rendered['get_cert'] = json.dumps({'text': rendered['text'], 'pem': rendered['pem'], 'metadata': rendered['metadata']})
+            certs[level]['rendered'][(tier, sn)] = rendered
+
 
 def get_cert_by_sn(params):
     global certs
@@ -252,67 +389,139 @@ def get_cert_by_sn(params):
         return json.dumps({'Results': "incorrect parameters received"})
     
     ID = params['ID'][0]
-    if ID not in database:
+    game = database.get(ID)
+    if game is None:
         return json.dumps({"Error": "ID {} not found in database, have you already played that game?".format(ID)})
 
-    level = int(database[params['ID'][0]]['level'])
+    level = int(game['level'])
     SN = int(params['SN'][0])
 
     if SN > 30 or SN < 0: # Magic numbers
         return json.dumps({'Results': "Cert SN should be in the range 0-30"})
 
     if SN in certs[level]['intermediates']:
-        return json.dumps({'text': certText(certs[level]['intermediates'][SN][0]),
-                           'pem': certPEM(certs[level]['intermediates'][SN][0]) })
+        return certs[level]['rendered'][('intermediates', SN)]['get_cert']
 
     return json.dumps({'Results': "Cert SN not found. Are you sure you used an intermediate cert SN?"})
 
 
-def sign_hint(signing_key, hint):
-    signature = crypto.sign(signing_key, hint, 'sha256')
-    return signature
+def get_crl(params):
+    '''
+    The (error, CRL, content type) for a level's CA, error is None if the request is valid.
+    format is pem (default) or der, and delta=N asks for the delta CRL from CRL number N.
+    '''
+    if 'level' not in params:
+        return json.dumps({'Results': "incorrect parameters received"}), None, None
 
+    try:
+        level = int(params['level'][0])
+        base = int(params['delta'][0]) if 'delta' in params else None
+    except ValueError as e:
+        return json.dumps({'Results': "Level and delta parameters must be ints"}), None, None
 
-def get_hint(params):
-    global database
-    global certs
+    if level not in revocations:
+        return json.dumps({'Results': "No CRL for level {}".format(level)}), None, None
 
-    if 'ID' not in params or 'level' not in params:
-        return json.dumps({'Results': "incorrect parameters received"})
+    encoding = params.get('format', ['pem'])[0]
+    if encoding not in ['pem', 'der']:
+        return json.dumps({'Results': "format should be pem or der"}), None, None
 
     try:
-        level = int(params['level'][0])
+        der, pem = revocations[level].crl(base)
     except ValueError as e:
-        return json.dumps({'Results': "Level parameter must be an int"})
-        
-    ID = params['ID'][0]
-    if ID not in database:
-        return json.dumps({"Error": "ID {} not found in database, have you already played that game?".format(ID)})
-    
+        return json.dumps({'Results': str(e)}), None, None
+
+    if encoding == 'der':
+        return None, der, 'application/pkix-crl'
+    return None, pem, 'application/x-pem-file'
+
+
+def sign_hint(signing_key, hint):
+    signature = crypto.sign(signing_key, hint, 'sha256')
+    return signature
+
+
+def make_hint(level, game):
     cert_sn = randint(11, 30) # Magic numbers
     selected_leaf_cert, selected_leaf_key, accurate = certs[level]['leafs'][cert_sn]
+    rendered = certs[level]['rendered'][('leafs', cert_sn)]
 
     if level == 0:
-        hint = "The number rhymes with {}".format(database[ID]['pick'])
-        signature = base64.b16encode(sign_hint(selected_leaf_key, hint)) # always sign accurate hint
+        hint = "The number rhymes with {}".format(game['pick'])
+        with sign_seconds.time(level=level):
+            signature = base64.b16encode(sign_hint(selected_leaf_key, hint)) # always sign accurate hint
 
         if not accurate: # change hint to ensure sig is invalid
             hint = "The number rhymes with {}".format(randint(0,2**31-1)) # Magic numbers
 
-        return json.dumps({"Hint": hint, 'Signature': signature, 'Signer': certText(selected_leaf_cert), 
-                           'cert_pem': crypto.dump_certificate(crypto.FILETYPE_PEM, selected_leaf_cert).decode('utf-8') })
+        return {"Hint": hint, 'Signature': signature, 'Signer': rendered['text'], 'cert_pem': rendered['pem'],
+                'cert_metadata': rendered['metadata']}
 
     elif level in [1, 2, 3, 4]:
 #        for ca in certs[level]['ca']: # print out the ca's for debugging
 #            print(certText(certs[level]['ca'][ca][0]))
 
         if accurate:
-            hint = "The number rhymes with {}".format(database[ID]['pick'])
+            hint = "The number rhymes with {}".format(game['pick'])
         else:
             hint = "The number rhymes with {}".format(randint(0,2**31-1)) # Magic numbers
-        signature = base64.b16encode(sign_hint(selected_leaf_key, hint))
-        return json.dumps({"Hint": hint, 'Signature': signature, 'Signer': certText(selected_leaf_cert), 
-                           'cert_pem': crypto.dump_certificate(crypto.FILETYPE_PEM, selected_leaf_cert).decode('utf-8') })
+        with sign_seconds.time(level=level):
+            signature = base64.b16encode(sign_hint(selected_leaf_key, hint))
+        return {"Hint": hint, 'Signature': signature, 'Signer': rendered['text'], 'cert_pem': rendered['pem'],
+                'cert_metadata': rendered['metadata']}
+
+
+def hint_game(params):
+    '''The (error, level, game) a hint request asks about, error is None if it is a valid one.'''
+    global database
+
+    if 'ID' not in params or 'level' not in params:
+        return json.dumps({'Results': "incorrect parameters received"}), None, None
+
+    try:
+        level = int(params['level'][0])
+    except ValueError as e:
+        return json.dumps({'Results': "Level parameter must be an int"}), None, None
+        
+    ID = params['ID'][0]
+    game = database.get(ID)
+    if game is None:
+        return json.dumps({"Error": "ID {} not found in database, have you already played that game?".format(ID)}), None, None
+    return None, level, game
+
+
+def get_hint(params):
+    error, level, game = hint_game(params)
+    if error is not None:
+        return error
+    
+    return json.dumps(make_hint(level, game))
+
+
+def get_hints(params):
+    '''
+    Like get_hint, but returns "count" independently drawn hints in one response, at most
+    max_hints of them, so a client can filter a whole batch locally instead of asking again.
+    '''
+    global database
+    global certs
+
+    if 'ID' not in params or 'level' not in params or 'count' not in params:
+        return json.dumps({'Results': "incorrect parameters received"})
+
+    try:
+        level = int(params['level'][0])
+        count = int(params['count'][0])
+    except ValueError as e:
+        return json.dumps({'Results': "Level and count parameters must be ints"})
+
+    ID = params['ID'][0]
+    game = database.get(ID)
+    if game is None:
+        return json.dumps({"Error": "ID {} not found in database, have you already played that game?".format(ID)})
+
+    count = max(1, min(count, max_hints))
+    return json.dumps({"Hints": [make_hint(level, game) for i in xrange(0, count)]})
 
 
 def pick_number(bits):
@@ -341,6 +550,7 @@ def init_game(level):
     digest = compute_hash(number + salt)
 
     database[ID] = {'pick': number, 'salt': salt, 'hash': digest, 'level': level}
+    games_started.inc(level=level)
 
     description = "Welcome to level{}. Thanks for playing! Pick a number between 0 and {}".format(level, 2**num_bits - 1)
     response = {"ID": ID, "commitment": digest, 'description': description}
@@ -356,69 +566,214 @@ def play_game(params):
     ID = params['ID'][0]
     guess = params['answer'][0]
 
-    if ID not in database:
+    game = database.pop(ID, None) # pop rather than check and del, another worker may be submitting the same ID
+    if game is None:
         return json.dumps({"Error": "ID {} not found in database, have you already played that game?".format(ID)})
 
-    if guess == database[ID]['pick']:
+    correct = True
+    if guess == game['pick']:
         outcome = "{} is Correct!".format(guess)
     else:
+        correct = False
         outcome = "{} is Incorrect :(".format(guess)
+    games_completed.inc(level=game['level'], outcome='correct' if correct else 'incorrect')
 
-    salt = database[ID]['salt']
-    input_text = database[ID]['pick'] + database[ID]['salt']
-    message = "md5sum({}) = {}".format(input_text, database[ID]['hash'])
-    del database[ID]
+    salt = game['salt']
+    input_text = game['pick'] + game['salt']
+    message = "md5sum({}) = {}".format(input_text, game['hash'])
     return json.dumps({"Results": outcome, "proof": message, 'Game_ID': ID})
 
 
+def batch_call(route, params):
+    '''Runs one operation of a POST /batch, see batch.py.'''
+    if route in ['level0', 'level1', 'level2', 'level3', 'level4']:
+        return init_game(route[-1])
+    elif route in ['submit']:
+        return play_game(params)
+    elif route in ['hint']:
+        return get_hint(params)
+    elif route in ['get_cert']:
+        return get_cert_by_sn(params)
+
+
+def stats():
+    report = database.stats()
+    if key_pool is not None:
+        report['key_pool'] = key_pool.stats()
+    return report
+
+
 # HTTPRequestHandler class
 class coinFlipHandler(BaseHTTPRequestHandler):
+    routes = ['level0', 'level1', 'level2', 'level3', 'level4', 'submit', 'stats', 'metrics', 'profile', 'hint', 'hints', 'get_cert', 'get_crl', 'batch', 'hint_stream']
  
 
+    @metrics.instrument
+    @ratelimit.limited
+    @profiling.profiled
     def do_GET(self):
-        # Send response status code
-        self.send_response(200)
-
-        # Send headers
-        self.send_header('Content-type','text/html')
-        self.end_headers()
-
+        content_type = 'text/html'
         path = self.path[1:].split("?")[0]
         query = parse_qs(urlparse(self.path).query)
         if path in ['level0', 'level1', 'level2', 'level3', 'level4']:
             message = init_game(path[-1])
         elif path in ['submit']:
             message = play_game(query)
+        elif path in ['metrics']:
+            message = metrics.render()
+            content_type = metrics.CONTENT_TYPE
+        elif path in ['profile']:
+            message = profiling.admin(self.client_address, query)
+        elif path in ['stats']:
+            message = json.dumps(stats())
         elif path in ['hint']:
             message = get_hint(query)
+        elif path in ['hints']:
+            message = get_hints(query)
+        elif path in ['hint_stream']:
+            self.stream_hints(query)
+            return
         elif path in ['get_cert']:
             message = get_cert_by_sn(query)
         elif path in ['get_crl']:
-            message = get_crl(query)
+            error, crl, content_type = get_crl(query)
+            if error is None: # sent byte for byte, a DER CRL can't take respond's newline
+                self.send_body(crl, content_type)
+                return
+            message = error
+        else:
+            message = json.dumps({"Error": "Requested endpoint not found. Available endpoints: level0-4, submit, hint, hints, hint_stream, get_cert, get_crl, batch (POST)"})
+
+        self.respond(message, content_type)
+        return
+
+    @metrics.instrument
+    @ratelimit.limited
+    @profiling.profiled
+    def do_POST(self):
+        path = self.path[1:].split("?")[0]
+        if path in ['batch']:
+            message = batch.execute(self, batch_call, max_batch)
         else:
-            message = json.dumps({"Error": "Requested endpoint not found. Available endpoints: level0-4, submit, hint, get_cert, crl"})
-        self.wfile.write(bytes(str(message) + "\n"))
+            self.close_connection = 1 # we never read the body
+            message = json.dumps({"Error": "Only batch takes POST requests"})
+
+        self.respond(message)
         return
+
+    def stream_hints(self, query):
+        '''
+        Writes signed hints for one game as newline delimited JSON until the client goes
+        away, the game is submitted or max_stream_hints have been sent. Each line goes
+        straight to the socket and the next hint is only signed once the kernel has taken
+        it, so a slow reader slows the stream down instead of piling hints up here. A
+        reader that takes nothing for stream_timeout seconds is dropped.
+        '''
+        if not max_stream_hints:
+            self.respond(json.dumps({"Error": "hint_stream is off on this server, it needs mode = threaded or prefork. Use hints instead"}))
+            return
+
+        error, level, game = hint_game(query)
+        if error is not None:
+            self.respond(error)
+            return
+        ID = query['ID'][0]
+
+        self.close_connection = 1 # the stream ends with the connection
+        self.send_response(200)
+        self.send_header('Content-type', 'application/x-ndjson')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.flush()
+
+        self.connection.settimeout(stream_timeout)
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 64 * 1024) # or the kernel may buffer megabytes for it
+        try:
+            for i in xrange(0, max_stream_hints):
+                if i and database.get(ID) is None:
+                    break
+                self.connection.sendall(json.dumps(make_hint(level, game)) + "\n")
+        except socket.error: # the client hung up or stopped reading
+            pass
+
+    def respond(self, message, content_type='text/html'):
+        self.send_body(bytes(str(message) + "\n"), content_type)
+
+    def send_body(self, body, content_type):
+        # Send response status code
+        self.send_response(200)
+
+        # Send headers, the length lets HTTP/1.1 clients keep the connection open
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        self.wfile.write(body)
  
 def run():
+    global database
+    global key_pool
+    global key_profiles
+    global max_hints
+    global max_batch
+    global max_stream_hints
+    global stream_timeout
+    global crl_lifetime
+
     print('starting server...')
 
-    for level in [0, 1, 2]:
-        init_certs(level)
+    # Read our local IP and serving options from file
+    try:
+        config = load_config('./server.config')
+    except Exception as e:
+        print("error loading config file. {}".format(e))
+        import sys
+        sys.exit(1)
 
-    # Read our local IP from file
-    with open('./server.config', 'r') as fh:
-        try:
-            ip = fh.readlines()[0]
-        except Exception as e:
-            print("error loading config file. {}".format(e))
-            import sys
-            sys.exit(1)
-
-    server_address = (ip, 9502)
-    httpd = HTTPServer(server_address, coinFlipHandler)
-    print('running server...')
-    httpd.serve_forever()
+    key_profiles = dict((name, value) for name, value in config.items() if name.startswith('key_profile'))
+    max_hints = config['max_hints']
+    max_batch = config['max_batch']
+    max_stream_hints = config['max_stream_hints']
+    if config['mode'] == 'single': # a stream would hold the only worker, and with it the whole server
+        max_stream_hints = 0
+    stream_timeout = config['stream_timeout']
+    crl_lifetime = config['crl_lifetime']
+
+    # fork the cert workers before any key pool threads exist, they must not share its keys
+    cert_pool = None
+    if config['cert_workers'] != 1:
+        cert_pool = multiprocessing.Pool(config['cert_workers'] or None, initializer=setKeyPool, initargs=(None,))
+
+    if config['key_pool'] and cert_pool is not None:
+        print("key_pool is only used with cert_workers = 1, the cert workers generate their own keys")
+    elif config['key_pool']:
+        flavor, bits = keyProfile(config['key_profile']) # tiers with a profile of their own bypass the pool
+        key_pool = KeyPool(flavor, bits, size=config['key_pool_size'], low_water=config['key_pool_low_water'],
+                           workers=config['key_pool_workers'])
+        setKeyPool(key_pool)
+
+    start = time.time()
+    for level in [0, 1, 2, 3]:
+        init_certs(level, cert_pool, config['cert_cache'])
+    print("cert hierarchy ready in {:.2f}s".format(time.time() - start))
+
+    if cert_pool is not None:
+        cert_pool.close()
+        cert_pool.join()
+
+    if key_pool is not None:
+        if config['mode'] == 'prefork': # its threads would not survive the fork, and might hold its lock when it happens
+            key_pool.stop()
+        print("key pool: {}".format(json.dumps(key_pool.stats())))
+
+    database = make_store(config, 'pki')
+
+    profiling.configure(config, 'pki')
+    ratelimit.configure(config, coinFlipHandler.routes)
+
+    server_address = (config['ip'], 9502)
+    print('running server in {} mode...'.format(config['mode']))
+    serve(server_address, coinFlipHandler, config)
  
  
 run()
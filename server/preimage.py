@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+'''
+    Multi-core MD5 preimage search for the hashing levels
+
+Finds a number n for which md5(str(n) + salt) answers a hashing-server commitment:
+
+    level0  search(commitment, stop=256)
+    level1  search(commitment, salt="|" + ID + "|" + time, stop=256)
+    level2  search(commitment, matches=k), where only the first and last k hex characters
+            have to agree, the same test as partial_match in hashing-server.py
+
+The candidates from start up to stop (forever when stop is None) are cut into batches of
+"batch" numbers and dealt round robin to "workers" processes, each hashing a whole batch
+in a tight loop before it looks up. The first worker to find an answer raises a shared
+flag, the others notice at the end of their current batch and report how much they
+hashed. A range that fits in one batch is searched in this process, forking isn't worth
+it for 256 candidates.
+
+search returns a dict with the answer (None when the range holds none) and the hashes,
+seconds and hashes_per_second it took.
+'''
+
+import hashlib
+import multiprocessing
+import time
+
+
+def scan(commitment, salt, matches, begin, end):
+    '''Hashes begin up to end, returns (the first answer or None, numbers hashed).'''
+    md5 = hashlib.md5
+    if matches is None:
+        for number in xrange(begin, end):
+            if md5(str(number) + salt).hexdigest() == commitment:
+                return number, number - begin + 1
+    else:
+        prefix, suffix = commitment[0:matches], commitment[-matches:]
+        for number in xrange(begin, end):
+            digest = md5(str(number) + salt).hexdigest()
+            if digest[0:matches] == prefix and digest[-matches:] == suffix:
+                return number, number - begin + 1
+    return None, end - begin
+
+
+def worker(commitment, salt, matches, begin, stop, batch, step, found, results):
+    hashed = 0
+    while not found.is_set() and (stop is None or begin < stop):
+        end = begin + batch if stop is None else min(begin + batch, stop)
+        answer, count = scan(commitment, salt, matches, begin, end)
+        hashed += count
+        if answer is not None:
+            found.set()
+            results.put((answer, hashed))
+            return
+        begin += step
+    results.put((None, hashed))
+
+
+def search(commitment, salt="", matches=None, start=0, stop=None, workers=None, batch=50000):
+    workers = workers or multiprocessing.cpu_count()
+    began = time.time()
+
+    if stop is not None and stop - start <= batch:
+        answer, hashed = scan(commitment, salt, matches, start, stop)
+        workers = 1
+    else:
+        found = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        processes = []
+        for i in xrange(0, workers):
+            process = multiprocessing.Process(target=worker, args=(commitment, salt, matches, start + i * batch, stop,
+                                                                   batch, workers * batch, found, results))
+            process.daemon = True
+            process.start()
+            processes.append(process)
+
+        answer, hashed = None, 0
+        for i in xrange(0, workers):
+            result, count = results.get()
+            hashed += count
+            if answer is None:
+                answer = result
+        for process in processes:
+            process.join()
+
+    elapsed = time.time() - began
+    return {'answer': answer,
+            'hashes': hashed,
+            'seconds': round(elapsed, 3),
+            'hashes_per_second': int(hashed / elapsed) if elapsed else hashed,
+            'workers': workers}
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+'''
+    On-demand request profiling for hashing-server.py and pki-server.py
+
+While the profiler is on, each request is profiled with cProfile with probability
+"fraction" and the results pile up in one pstats aggregate. Dumping writes the aggregate
+to <profile_dir>/<server>-<time>.prof and starts a fresh one. Turn the file into a
+flamegraph with flameprof, or browse it with snakeviz or python -m pstats.
+
+Turn it on at startup with profile = true in server.config, or at any time through the
+/profile endpoint, which only answers requests from admin_addresses:
+
+    /profile?action=start&fraction=0.05
+    /profile?action=dump
+    /profile?action=stop
+    /profile?action=status
+'''
+
+from datetime import datetime
+from random import random
+
+import cProfile
+import json
+import os
+import pstats
+import threading
+
+
+class Profiler(object):
+
+    def __init__(self, name='server', directory='profiles', fraction=0.01, enabled=False):
+        self.name = name
+        self.admins = ['127.0.0.1']
+        self.directory = directory
+        self.fraction = fraction
+        self.enabled = enabled
+        self.stats = None
+        self.sampled = 0
+        self.lock = threading.Lock()
+
+    def run(self, function, *args):
+        if not self.enabled or random() >= self.fraction:
+            return function(*args)
+
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(function, *args)
+        finally:
+            with self.lock:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profile)
+                else:
+                    self.stats.add(profile)
+                self.sampled += 1
+
+    def dump(self):
+        with self.lock:
+            stats, sampled = self.stats, self.sampled
+            self.stats, self.sampled = None, 0
+        if stats is None:
+            return None
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = os.path.join(self.directory, "{}-{}.prof".format(self.name, datetime.now().strftime('%Y%m%d-%H%M%S')))
+        stats.dump_stats(path)
+        return path, sampled
+
+    def status(self):
+        with self.lock:
+            return {'enabled': self.enabled, 'fraction': self.fraction, 'sampled': self.sampled}
+
+
+profiler = Profiler()
+
+
+def configure(config, name):
+    profiler.name = name
+    profiler.directory = config['profile_dir']
+    profiler.fraction = config['profile_fraction']
+    profiler.enabled = config['profile']
+    profiler.admins = [address.strip() for address in str(config['admin_addresses']).split(",")]
+
+
+def profiled(do_GET):
+    '''Wraps a handler's do_GET so the profiler can sample it.'''
+    def sampled(self):
+        return profiler.run(do_GET, self)
+    return sampled
+
+
+def admin(client_address, params):
+    if client_address[0] not in profiler.admins:
+        return json.dumps({'Error': "profiling can only be controlled from the server itself"})
+
+    action = params.get('action', ['status'])[0]
+    if action == 'start':
+        if 'fraction' in params:
+            try:
+                profiler.fraction = min(1.0, max(0.0, float(params['fraction'][0])))
+            except ValueError:
+                return json.dumps({'Error': "fraction must be a number between 0 and 1"})
+        profiler.enabled = True
+    elif action == 'stop':
+        profiler.enabled = False
+    elif action == 'dump':
+        dumped = profiler.dump()
+        if dumped is None:
+            return json.dumps({'Error': "no requests have been profiled since the last dump"})
+        report = profiler.status()
+        report['file'], report['requests'] = dumped
+        return json.dumps(report)
+    elif action != 'status':
+        return json.dumps({'Error': "action must be one of start, stop, dump or status"})
+    return json.dumps(profiler.status())
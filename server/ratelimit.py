@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+'''
+    Per-client rate limiting for hashing-server.py and pki-server.py
+
+Every client address gets a token bucket per route: it holds up to "burst" requests and
+refills at "rate" requests a second. A request that finds its bucket empty is answered
+429 straight away, before the handler does any hashing or signing. On top of that a
+route can have a total rate shared by all clients, past which everyone gets a 503 so the
+server keeps up with the requests it does accept.
+
+All of it is off until a rate is set in server.config:
+
+    rate_limit = 5                 every route, per client, requests per second
+    rate_burst = 20                bucket size, defaults to twice the rate, never below 1
+    rate_limit.hint = 2            override for one route, rate_burst.hint likewise
+    rate_limit_total.level2 = 200  all clients together, rate_burst_total.level2 likewise
+
+A rate of 0 leaves a route unlimited. Rejections are counted in /metrics by route and
+status.
+'''
+
+import json
+import metrics
+import threading
+import time
+
+
+class Bucket(object):
+    __slots__ = ['rate', 'burst', 'tokens', 'updated']
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now):
+        self.refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class RateLimiter(object):
+
+    def __init__(self):
+        self.limits = {}  # route -> (rate, burst, total rate, total burst)
+        self.buckets = {}  # (client, route) -> Bucket, client None for the route's total
+        self.lock = threading.Lock()
+        self.pruned = time.time()
+
+    def configure(self, config, routes):
+        rate = config['rate_limit']
+        burst = config['rate_burst'] or 2 * rate
+        for route in routes + ['other']:
+            route_rate = config.get('rate_limit.' + route, rate)
+            route_burst = config.get('rate_burst.' + route, burst if route_rate == rate else 2 * route_rate)
+            total_rate = config.get('rate_limit_total.' + route, 0)
+            total_burst = config.get('rate_burst_total.' + route, 2 * total_rate)
+            # a bucket that can't hold one whole token would turn every request away
+            self.limits[route] = (route_rate, max(1, route_burst), total_rate, max(1, total_burst))
+        self.buckets = {}
+
+    def take(self, key, rate, burst, now):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = Bucket(rate, burst, now)
+        return bucket.take(now)
+
+    def prune(self, now):
+        # a bucket that has refilled completely is the same as no bucket, forget it
+        for key, bucket in self.buckets.items():
+            bucket.refill(now)
+            if bucket.tokens >= bucket.burst:
+                del self.buckets[key]
+        self.pruned = now
+
+    def admit(self, client, route):
+        '''Returns None to let the request through, or the status to reject it with.'''
+        rate, burst, total_rate, total_burst = self.limits.get(route, (0, 0, 0, 0))
+        if not rate and not total_rate:
+            return None
+
+        now = time.time()
+        with self.lock:
+            if now - self.pruned > 60:
+                self.prune(now)
+            if rate and not self.take((client, route), rate, burst, now):
+                return 429
+            if total_rate and not self.take((None, route), total_rate, total_burst, now):
+                return 503
+        return None
+
+
+limiter = RateLimiter()
+
+rejected = metrics.Counter('workshop_rate_limited_total', 'Requests turned away by the rate limiter, by route and status', ['route', 'status'])
+
+
+def configure(config, routes):
+    limiter.configure(config, routes)
+
+
+def reject(client, route):
+    '''None when the request may go ahead, otherwise the (status, reason, body) to refuse it with.'''
+    status = limiter.admit(client, route)
+    if status is None:
+        return None
+
+    rejected.inc(route=route, status=status)
+    if status == 429:
+        return status, 'Too Many Requests', json.dumps({'Error': "Too many {} requests, slow down".format(route)})
+    return status, 'Service Unavailable', json.dumps({'Error': "The server is busy, try again shortly"})
+
+
+def limited(do_GET):
+    '''
+    Wraps a handler's do_GET or do_POST so requests over the limit are rejected before it
+    runs. A rejected request's body is never read, so its connection is closed.
+    '''
+    def admitted(self):
+        route = self.path[1:].split("?")[0]
+        if route not in self.routes:
+            route = 'other'
+
+        rejection = reject(self.client_address[0], route)
+        if rejection is None:
+            return do_GET(self)
+
+        status, reason, body = rejection
+        body += "\n"
+        self.send_response(status, reason)
+        self.send_header('Content-type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Retry-After', '1')
+        if self.headers.getheader('Content-Length') or self.headers.getheader('Transfer-Encoding'):
+            self.send_header('Connection', 'close') # the body is left unread, the connection can't carry another request
+        self.end_headers()
+        self.wfile.write(body)
+    return admitted
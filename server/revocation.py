@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+'''
+    Certificate revocation for pki-server.py
+
+Every level keeps a RevocationList: the serials revoked at that level, indexed by serial,
+and CRLs for them signed by the level's CA. Each revocation bumps the list's CRL number.
+A CRL is signed and encoded, as DER and PEM, the first time it is asked for, then served
+from memory until the next revocation throws it away or it gets within half its lifetime
+of its nextUpdate.
+
+A delta CRL (RFC 5280 section 5.2.4) only carries the serials revoked after the base CRL
+number it names. A client holding CRL number 7 asks for the delta from 7 and downloads
+the few serials revoked since instead of the whole list again.
+'''
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from datetime import datetime, timedelta
+
+import threading
+import time
+
+
+class RevocationList(object):
+
+    def __init__(self, issuer_cert, issuer_key, lifetime=3600):
+        self.issuer = issuer_cert.to_cryptography().subject
+        self.key = issuer_key.to_cryptography_key()
+        self.lifetime = lifetime
+        self.revoked = {}  # serial -> (CRL number that revoked it, revocation date, reason)
+        self.number = 0
+        self.cache = {}  # base CRL number, None for the full CRL -> (DER, PEM, re-sign after)
+        self.lock = threading.Lock()
+
+    def revoke(self, serial, reason='unspecified', when=None):
+        '''
+        Revokes serial with one of the RFC 5280 reasons, e.g. keyCompromise or superseded.
+        Returns False if it was revoked already.
+        '''
+        reason = x509.ReasonFlags(reason)
+        with self.lock:
+            if serial in self.revoked:
+                return False
+            self.number += 1
+            self.revoked[serial] = (self.number, when or datetime.utcnow(), reason)
+            self.cache = {}
+        return True
+
+    def build(self, base):
+        now = datetime.utcnow()
+        builder = x509.CertificateRevocationListBuilder().issuer_name(self.issuer)
+        builder = builder.last_update(now).next_update(now + timedelta(seconds=self.lifetime))
+        builder = builder.add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(self.key.public_key()), critical=False)
+        builder = builder.add_extension(x509.CRLNumber(self.number), critical=False)
+        if base is not None:
+            builder = builder.add_extension(x509.DeltaCRLIndicator(base), critical=True)
+
+        for serial, (number, when, reason) in sorted(self.revoked.items()):
+            if base is not None and number <= base:
+                continue
+            entry = x509.RevokedCertificateBuilder().serial_number(serial).revocation_date(when)
+            if reason != x509.ReasonFlags.unspecified: # RFC 5280 says to leave the reason out instead
+                entry = entry.add_extension(x509.CRLReason(reason), critical=False)
+            builder = builder.add_revoked_certificate(entry.build(default_backend()))
+
+        crl = builder.sign(self.key, hashes.SHA256(), default_backend())
+        return (crl.public_bytes(serialization.Encoding.DER),
+                crl.public_bytes(serialization.Encoding.PEM),
+                time.time() + self.lifetime / 2.0)
+
+    def crl(self, base=None):
+        '''The (DER, PEM) of the full CRL, or of the delta CRL from CRL number base.'''
+        if base is not None and not 0 <= base <= self.number:
+            raise ValueError("delta must be a CRL number from 0 to {}".format(self.number))
+
+        with self.lock: # one thread signs, any others asking meanwhile wait for its result
+            cached = self.cache.get(base)
+            if cached is None or time.time() > cached[2]:
+                cached = self.cache[base] = self.build(base)
+        return cached[0], cached[1]
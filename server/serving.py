@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+'''
+    HTTP server construction shared by hashing-server.py and pki-server.py
+
+The handlers stay exactly the same, only the server object in front of them changes.
+Pick one with the "mode" setting in server.config:
+
+    single   - the original HTTPServer, one request at a time
+    threaded - a fixed pool of "workers" threads pulls accepted connections off a queue,
+               so a slow client or a slow signature only ties up one worker. Connections
+               are kept alive (HTTP/1.1) unless keepalive is turned off
+    prefork  - "processes" copies of the threaded server, each listening on the same port
+               with SO_REUSEPORT so the kernel spreads connections across them. This gets
+               past the one core a single Python process can use. A supervisor process
+               restarts any that die. Games must be in the sqlite session store so every
+               process sees them
+'''
+
+from BaseHTTPServer import HTTPServer
+from Queue import Queue
+
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+
+
+class ThreadPoolMixIn:
+    workers = 16
+
+    def start_workers(self):
+        self.requests = Queue(self.request_queue_size)
+        for i in xrange(0, self.workers):
+            worker = threading.Thread(target=self.process_request_worker, name="worker-{}".format(i))
+            worker.daemon = True
+            worker.start()
+
+    def process_request_worker(self):
+        while True:
+            request, client_address = self.requests.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def process_request(self, request, client_address):
+        self.requests.put((request, client_address))
+
+
+class ThreadPoolHTTPServer(ThreadPoolMixIn, HTTPServer):
+    pass
+
+
+class PreforkHTTPServer(ThreadPoolHTTPServer):
+
+    def server_bind(self):
+        # every worker process binds its own socket to the port, the kernel balances between them
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        HTTPServer.server_bind(self)
+
+
+def make_server(server_address, handler, config):
+    mode = config['mode']
+
+    if config['keepalive'] and mode != 'single':
+        # a kept alive connection holds its worker, so idle ones are dropped after a while.
+        # single mode stays on HTTP/1.0, one idle client would lock everyone else out
+        class KeepAliveHandler(handler):
+            protocol_version = 'HTTP/1.1'
+            timeout = config['keepalive_timeout']
+            # send status, headers and body in one go, each header in its own small packet
+            # would wait on the client's delayed ack for every request on the connection
+            wbufsize = -1
+            disable_nagle_algorithm = True
+        handler = KeepAliveHandler
+
+    if mode == 'single':
+        httpd = HTTPServer(server_address, handler, bind_and_activate=False)
+    elif mode == 'threaded':
+        httpd = ThreadPoolHTTPServer(server_address, handler, bind_and_activate=False)
+        httpd.workers = config['workers']
+    elif mode == 'prefork':
+        httpd = PreforkHTTPServer(server_address, handler, bind_and_activate=False)
+        httpd.workers = config['workers']
+    else:
+        raise ValueError("unknown server mode {}, expected single, threaded or prefork".format(mode))
+
+    httpd.request_queue_size = config['backlog']
+    try:
+        httpd.server_bind()
+        httpd.server_activate()
+    except Exception:
+        httpd.server_close()
+        raise
+
+    if mode in ['threaded', 'prefork']:
+        httpd.start_workers()
+    return httpd
+
+
+def supervise(worker, processes):
+    '''
+    Forks processes children running worker() and restarts any that exit, until the
+    supervisor gets SIGTERM or SIGINT and takes them all down with it.
+    '''
+    children = {}  # pid -> (slot, start time)
+    stopping = []
+
+    def spawn(slot):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                worker()
+            finally:
+                os._exit(1)
+        children[pid] = (slot, time.time())
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for slot in xrange(0, processes):
+        spawn(slot)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except OSError: # interrupted by a signal, stop has dealt with it
+            continue
+        if pid not in children:
+            continue
+        slot, started = children.pop(pid)
+        if stopping:
+            continue
+
+        print("worker {} (pid {}) exited with status {}, restarting it".format(slot, pid, status))
+        if time.time() - started < 1: # don't spin if it dies straight away
+            time.sleep(1)
+        spawn(slot)
+
+
+def serve(server_address, handler, config):
+    '''Builds the server for config's mode and serves forever, across processes in prefork mode.'''
+    if config['mode'] != 'prefork':
+        make_server(server_address, handler, config).serve_forever()
+        return
+
+    if config['session_backend'] != 'sqlite':
+        raise ValueError("prefork mode needs session_backend = sqlite, a game may be submitted to any process")
+
+    # fail here rather than in every child, if the port is taken by something without SO_REUSEPORT
+    PreforkHTTPServer(server_address, handler).server_close()
+
+    def worker():
+        make_server(server_address, handler, config).serve_forever()
+
+    supervise(worker, config['processes'] or multiprocessing.cpu_count())
@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+
+'''
+    Session storage for in-flight games
+
+Games are keyed by their ID and hold whatever init_game needs to settle them later.
+Both backends behave like the dict they replace, but every entry carries an expiry time
+and the store holds at most "capacity" games. Pick one with session_backend in
+server.config, make_store does the rest.
+
+    memory - SessionStore, lives and dies with the process
+    sqlite - SQLiteSessionStore, survives restarts and can be shared by several
+             server processes on the same box
+'''
+
+from collections import deque
+
+import binascii
+import copy
+import json
+import os
+import sqlite3
+import struct
+import threading
+import time
+import uuid
+
+
+# expires, level, flags, matches, pick, md5 digest of the commitment, then the salt
+RECORD = struct.Struct('<dcBiI16s')
+SALT_NONE, SALT_UUID, SALT_TEXT, SALT_RAW = 0, 1, 2, 3  # flags & 3, how the salt is stored
+HAS_MATCHES = 4
+
+
+def canonical_uuid(text):
+    try:
+        return str(uuid.UUID(text)) == text
+    except (TypeError, ValueError):
+        return False
+
+
+def record_key(ID):
+    '''Game IDs are UUIDs, 16 bytes say as much as their 36 characters of text.'''
+    if isinstance(ID, basestring) and canonical_uuid(ID):
+        return uuid.UUID(ID).bytes
+    return (ID,)
+
+
+def pack(ID, expires, game):
+    '''
+    Packs a game as init_game builds them into one string, or returns None for anything
+    unpack could not give back exactly as it was.
+    '''
+    if not set(game) - set(['matches']) == set(['pick', 'salt', 'hash', 'level']):
+        return None
+    pick, salt, digest, level = game['pick'], game['salt'], game['hash'], game['level']
+    matches = game.get('matches', 0)
+    if not all(isinstance(value, str) for value in [ID, pick, salt, digest, level]) or type(matches) is not int:
+        return None
+    if len(level) != 1 or not pick.isdigit() or str(int(pick)) != pick or int(pick) >= 2**32 or not -2**31 <= matches < 2**31:
+        return None
+    if len(digest) != 32 or digest != digest.lower() or digest.strip('0123456789abcdef'):
+        return None
+
+    # the salt of every level but 0 starts with the game's own ID, no need to keep it twice
+    prefix = "|" + ID + "|"
+    if salt == "":
+        flags, salt = SALT_NONE, ""
+    elif salt.startswith(prefix) and canonical_uuid(salt[len(prefix):]):
+        flags, salt = SALT_UUID, uuid.UUID(salt[len(prefix):]).bytes
+    elif salt.startswith(prefix):
+        flags, salt = SALT_TEXT, salt[len(prefix):]
+    else:
+        flags = SALT_RAW
+    if 'matches' in game:
+        flags |= HAS_MATCHES
+
+    return RECORD.pack(expires, level, flags, matches, int(pick), binascii.unhexlify(digest)) + salt
+
+
+def unpack(ID, record):
+    '''The expiry time and game dict of a record made by pack.'''
+    expires, level, flags, matches, pick, digest = RECORD.unpack_from(record)
+    salt = record[RECORD.size:]
+    ID = str(ID) # a unicode ID finds the same game, the salt stays a str
+    kind = flags & 3
+    if kind == SALT_UUID:
+        salt = "|" + ID + "|" + str(uuid.UUID(bytes=salt))
+    elif kind == SALT_TEXT:
+        salt = "|" + ID + "|" + salt
+
+    game = {'pick': str(pick), 'salt': salt, 'hash': binascii.hexlify(digest), 'level': level}
+    if flags & HAS_MATCHES:
+        game['matches'] = matches
+    return expires, game
+
+
+class SessionStore(object):
+    '''
+    Entries are kept in insertion order, which is also expiry order when everyone uses
+    the default ttl. Each insert sweeps expired games off the front, so the cost of
+    expiring is spread across inserts and no background thread is needed. If the store
+    is still full after the sweep the oldest game is dropped. Lookups never return an
+    expired game even if the sweep has not reached it yet.
+
+    With a few hundred thousand games open the per game overhead adds up, so entries
+    are kept small: the ID as its 16 UUID bytes, the game and its expiry time packed
+    into one string (see pack), and the insertion order in a deque of keys rather than
+    an OrderedDict. Keys of games already played stay in the deque until the sweep gets
+    to them or it is compacted. get and pop return a fresh dict equal to the one stored.
+    Games that don't look like init_game's are kept as they are.
+    '''
+
+    def __init__(self, ttl=60 * 60, capacity=100000):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.entries = {}  # key -> packed record, or (expires, game) if it doesn't pack
+        self.order = deque()  # keys in insertion order, including some already gone
+        self.lock = threading.Lock()
+        self.evictions = {'expired': 0, 'capacity': 0}
+
+    def expiry(self, value):
+        if isinstance(value, tuple):
+            return value[0]
+        return RECORD.unpack_from(value)[0]
+
+    def decode(self, ID, value):
+        if isinstance(value, tuple): # a copy, so a caller changing it can't change the store
+            return value[0], copy.deepcopy(value[1])
+        return unpack(ID, value)
+
+    def oldest(self):
+        '''The key of the oldest game still stored, dropping keys of games gone since.'''
+        while self.order:
+            if self.order[0] in self.entries:
+                return self.order[0]
+            self.order.popleft()
+        return None
+
+    def sweep(self, now):
+        while self.entries:
+            key = self.oldest()
+            if self.expiry(self.entries[key]) > now:
+                break
+            del self.entries[key]
+            self.order.popleft()
+            self.evictions['expired'] += 1
+
+    def put(self, ID, game, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        now = time.time()
+        key = record_key(ID)
+        record = pack(ID, now + ttl, game)
+        if record is None:
+            record = (now + ttl, game)
+
+        with self.lock:
+            self.sweep(now)
+            if self.entries.pop(key, None) is not None:
+                self.order.remove(key) # a game stored again goes to the back, as it did in an OrderedDict
+            while len(self.entries) >= self.capacity:
+                del self.entries[self.oldest()]
+                self.order.popleft()
+                self.evictions['capacity'] += 1
+            self.entries[key] = record
+            self.order.append(key)
+
+            if len(self.order) > 2 * len(self.entries) + 1024: # mostly played games, drop their keys
+                self.order = deque(key for key in self.order if key in self.entries)
+
+    def get(self, ID, default=None):
+        key = record_key(ID)
+        with self.lock:
+            if key not in self.entries:
+                return default
+            expires, game = self.decode(ID, self.entries[key])
+            if expires <= time.time():
+                del self.entries[key]
+                self.evictions['expired'] += 1
+                return default
+            return game
+
+    def pop(self, ID, default=None):
+        key = record_key(ID)
+        with self.lock:
+            if key not in self.entries:
+                return default
+            expires, game = self.decode(ID, self.entries.pop(key))
+            if expires <= time.time():
+                self.evictions['expired'] += 1
+                return default
+            return game
+
+    def stats(self):
+        with self.lock:
+            return {'sessions': len(self.entries),
+                    'capacity': self.capacity,
+                    'ttl': self.ttl,
+                    'expired': self.evictions['expired'],
+                    'evicted_at_capacity': self.evictions['capacity']}
+
+    def __setitem__(self, ID, game):
+        self.put(ID, game)
+
+    def __getitem__(self, ID):
+        game = self.get(ID)
+        if game is None:
+            raise KeyError(ID)
+        return game
+
+    def __contains__(self, ID):
+        return self.get(ID) is not None
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SQLiteSessionStore(object):
+    '''
+    Games live in one table of a local SQLite database in WAL mode, so readers never
+    block and any number of server processes can open the same file.
+
+    Inserts are group committed: whichever thread finds no write in progress takes
+    every pending insert and writes them in one transaction while the others wait for
+    it, so under load many new games share a single commit. put only returns once its
+    game is on disk, so another process can always see a game whose ID we handed out.
+    Expiry and capacity are enforced in the same transaction, and the eviction counts
+    are stored alongside so every process reports the same totals. Triggers keep the
+    number of games in the counts table, so checking capacity never has to count rows.
+    '''
+
+    def __init__(self, path, ttl=60 * 60, capacity=100000):
+        self.path = path
+        self.ttl = ttl
+        self.capacity = capacity
+        self.local = threading.local()
+        self.cond = threading.Condition()
+        self.pending = []   # rows waiting for the next commit
+        self.batch = 0      # number of the batch pending rows will be written in
+        self.written = 0    # every batch below this number is done, for better or worse
+        self.failed = {}    # number of a batch whose commit failed -> waiters yet to hear of it
+        self.flushing = False
+
+        db = self.connection()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS games (id TEXT PRIMARY KEY, expires REAL, game TEXT)")
+        db.execute("CREATE INDEX IF NOT EXISTS games_expires ON games (expires)")
+        db.execute("CREATE TABLE IF NOT EXISTS evictions (kind TEXT PRIMARY KEY, count INTEGER)")
+        db.execute("INSERT OR IGNORE INTO evictions VALUES ('expired', 0), ('capacity', 0)")
+
+        db.execute("BEGIN IMMEDIATE") # no other process may add games between the count and the triggers
+        try:
+            db.execute("CREATE TABLE IF NOT EXISTS counts (name TEXT PRIMARY KEY, count INTEGER)")
+            db.execute("INSERT OR IGNORE INTO counts SELECT 'games', COUNT(*) FROM games")
+            db.execute("CREATE TRIGGER IF NOT EXISTS games_added AFTER INSERT ON games "
+                       "BEGIN UPDATE counts SET count = count + 1 WHERE name = 'games'; END")
+            db.execute("CREATE TRIGGER IF NOT EXISTS games_removed AFTER DELETE ON games "
+                       "BEGIN UPDATE counts SET count = count - 1 WHERE name = 'games'; END")
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def connection(self):
+        # a connection must not cross a fork, a prefork worker opens its own
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self.local.db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db.execute("PRAGMA recursive_triggers=ON") # so a replaced game is counted out too
+            self.local.pid = os.getpid()
+        return self.local.db
+
+    def count(self, db):
+        return db.execute("SELECT count FROM counts WHERE name = 'games'").fetchone()[0]
+
+    def encode(self, game):
+        return json.dumps(game)
+
+    def decode(self, text):
+        game = json.loads(text)
+        return dict((str(key), str(value) if isinstance(value, unicode) else value) for key, value in game.items())
+
+    def write(self, rows):
+        now = time.time()
+        db = self.connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany("INSERT OR REPLACE INTO games VALUES (?, ?, ?)", rows)
+
+            expired = db.execute("DELETE FROM games WHERE expires <= ?", (now,)).rowcount
+            overflow = self.count(db) - self.capacity
+            if overflow > 0:
+                db.execute("DELETE FROM games WHERE id IN (SELECT id FROM games ORDER BY expires LIMIT ?)", (overflow,))
+            else:
+                overflow = 0
+
+            db.execute("UPDATE evictions SET count = count + ? WHERE kind = 'expired'", (expired,))
+            db.execute("UPDATE evictions SET count = count + ? WHERE kind = 'capacity'", (overflow,))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def put(self, ID, game, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+
+        with self.cond:
+            self.pending.append((ID, time.time() + ttl, self.encode(game)))
+            ticket = self.batch
+
+            while self.written <= ticket:
+                if self.flushing:
+                    self.cond.wait()
+                    continue
+
+                # nobody is writing, so we write everything pending including our own row
+                self.flushing = True
+                rows, self.pending = self.pending, []
+                self.batch += 1
+                self.cond.release()
+                failed = True
+                try:
+                    self.write(rows)
+                    failed = False
+                finally:
+                    self.cond.acquire()
+                    if failed and len(rows) > 1: # we raise the error ourselves, the others get an IOError
+                        self.failed[ticket] = len(rows) - 1
+                    self.flushing = False
+                    self.written = self.batch
+                    self.cond.notify_all()
+
+            if ticket in self.failed:
+                self.failed[ticket] -= 1
+                if not self.failed[ticket]:
+                    del self.failed[ticket]
+                raise IOError("failed to write game {} to {}".format(ID, self.path))
+
+    def get(self, ID, default=None):
+        row = self.connection().execute("SELECT expires, game FROM games WHERE id = ?", (ID,)).fetchone()
+        if row is None or row[0] <= time.time():
+            return default
+        return self.decode(row[1])
+
+    def pop(self, ID, default=None):
+        db = self.connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT expires, game FROM games WHERE id = ?", (ID,)).fetchone()
+            if row is not None:
+                db.execute("DELETE FROM games WHERE id = ?", (ID,))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+        if row is None or row[0] <= time.time():
+            return default
+        return self.decode(row[1])
+
+    def stats(self):
+        db = self.connection()
+        evictions = dict(db.execute("SELECT kind, count FROM evictions").fetchall())
+        return {'sessions': self.count(db),
+                'capacity': self.capacity,
+                'ttl': self.ttl,
+                'expired': evictions['expired'],
+                'evicted_at_capacity': evictions['capacity']}
+
+    def __setitem__(self, ID, game):
+        self.put(ID, game)
+
+    def __getitem__(self, ID):
+        game = self.get(ID)
+        if game is None:
+            raise KeyError(ID)
+        return game
+
+    def __contains__(self, ID):
+        return self.get(ID) is not None
+
+    def __len__(self):
+        return self.count(self.connection())
+
+
+def make_store(config, name):
+    backend = config['session_backend']
+
+    if backend == 'memory':
+        return SessionStore(config['session_ttl'], config['session_capacity'])
+
+    if backend == 'sqlite':
+        path = os.path.join(config['session_dir'], "{}-sessions.db".format(name))
+        return SQLiteSessionStore(path, config['session_ttl'], config['session_capacity'])
+
+    raise ValueError("unknown session backend {}, expected memory or sqlite".format(backend))